@@ -3,20 +3,26 @@
 from __future__ import annotations
 
 import asyncio
+import functools
 
 # from datetime import timedelta
 import logging
+import time
 
 import voluptuous as vol
 
 # from homeassistant.config_entries import ConfigEntry
 from homeassistant import config_entries
 from homeassistant.const import Platform
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, ServiceCall, callback
 
-# from homeassistant.exceptions import ConfigEntryAuthFailed, ConfigEntryNotReady
+# from homeassistant.exceptions import ConfigEntryAuthFailed
+from homeassistant.exceptions import ConfigEntryNotReady, HomeAssistantError
 # from homeassistant.components.light import PLATFORM_SCHEMA
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.service import async_extract_referenced_entity_ids
 from homeassistant.helpers.typing import ConfigType
 from homeassistant.helpers.update_coordinator import (
     CoordinatorEntity,
@@ -25,7 +31,22 @@ from homeassistant.helpers.update_coordinator import (
 )
 
 from . import pixiepluslogin
-from .const import DOMAIN
+from .command_queue import CommandQueue
+from .connection import async_get_manager
+from .latency import LatencyStats
+from .pending import PendingCommands
+from .const import (
+    CONF_COMMAND_BURST,
+    CONF_COMMAND_CONCURRENCY,
+    CONF_COMMAND_RATE,
+    CONF_JSON_OFFLOAD_SIZE,
+    CONF_PARSE_OFFLOAD_DEVICES,
+    COMMAND_CONFIRM_TIMEOUT,
+    DOMAIN,
+    SIGNAL_DEVICE_UPDATE,
+    STATE_WRITE_WINDOW,
+)
+from .snapshot import PixieSnapshot
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -33,6 +54,7 @@ PLATFORMS: list[Platform] = [
     Platform.LIGHT,
     Platform.SWITCH,
     Platform.COVER,
+    Platform.SENSOR,
 ]
 
 CONF_COVER_COMMAND = "command"
@@ -41,8 +63,10 @@ CONF_COVER = "cover"
 CONF_OPEN = "open"
 CONF_CLOSE = "close"
 CONF_COVER_STOP = "stop"
+CONF_CLOUD_URL = "cloud_url"
+CONF_STATE_WRITE_WINDOW = "state_write_window"
 
-# Validation of cover configuration from configuration.yaml
+# Validation of the pixie_plus configuration from configuration.yaml
 
 COMMAND_SCHEMA = vol.Schema(
     {
@@ -52,18 +76,47 @@ COMMAND_SCHEMA = vol.Schema(
     }
 )
 
-COVER_SCHEMA = vol.Schema(
-    {vol.Optional(CONF_COVER): vol.Schema({cv.string: COMMAND_SCHEMA})},
+PIXIE_SCHEMA = vol.Schema(
+    {
+        vol.Optional(CONF_COVER): vol.Schema({cv.string: COMMAND_SCHEMA}),
+        # for testing against a local stand-in of the Pixie cloud
+        vol.Optional(CONF_CLOUD_URL): cv.url,
+        # seconds entity state writes are gathered for before they are flushed together
+        vol.Optional(CONF_STATE_WRITE_WINDOW): vol.All(
+            vol.Coerce(float), vol.Range(min=0, max=1)
+        ),
+        # outbound command limits, commands per second, burst and PUTs in flight
+        vol.Optional(CONF_COMMAND_RATE): vol.All(
+            vol.Coerce(float), vol.Range(min=0.1)
+        ),
+        vol.Optional(CONF_COMMAND_BURST): cv.positive_int,
+        vol.Optional(CONF_COMMAND_CONCURRENCY): cv.positive_int,
+        # payload size (bytes) and device count above which parsing moves to a worker thread
+        vol.Optional(CONF_JSON_OFFLOAD_SIZE): cv.positive_int,
+        vol.Optional(CONF_PARSE_OFFLOAD_DEVICES): cv.positive_int,
+    },
     extra=vol.ALLOW_EXTRA,
 )
 
 CONFIG_SCHEMA = vol.Schema(
     {
-        DOMAIN: COVER_SCHEMA,
+        DOMAIN: PIXIE_SCHEMA,
     },
     extra=vol.ALLOW_EXTRA,
 )
 
+SERVICE_WAIT_FOR_CONFIRMATION = "wait_for_confirmation"
+ATTR_TIMEOUT = "timeout"
+
+# entity_id, device_id and area_id targets, like services.yaml declares
+WAIT_FOR_CONFIRMATION_SCHEMA = cv.make_entity_service_schema(
+    {
+        vol.Optional(ATTR_TIMEOUT, default=COMMAND_CONFIRM_TIMEOUT): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+    }
+)
+
 
 async def async_setup_entry(
     hass: HomeAssistant,
@@ -72,32 +125,88 @@ async def async_setup_entry(
     """Set up pixie_plus from a config entry."""
 
     config = config_entry.data
-
-    (devices_list, session_data) = await pixiepluslogin.pixie_login(hass, config)
-
-    coordinator = MyCoordinator(hass, config, session_data, devices_list)
-    await coordinator.async_config_entry_first_refresh()
+    snapshot = PixieSnapshot(hass, config_entry.entry_id)
+    started = time.monotonic()
+
+    # entities are created from the last known devices, the cloud catches up in the background
+    restored = await snapshot.async_restore(config)
+    if restored is not None:
+        _LOGGER.debug("Starting from the persisted device snapshot")
+        (devices_list, session) = restored
+    else:
+        (devices_list, session) = await pixiepluslogin.pixie_login(hass, config)
+        if devices_list is None:
+            raise ConfigEntryNotReady("Unable to get Pixie Plus devices")
+    _LOGGER.debug("setup stage devices took %.2fs", time.monotonic() - started)
+
+    coordinator = MyCoordinator(
+        hass, config, session, devices_list, config_entry.entry_id, snapshot
+    )
+    # the devices were just fetched or restored, no need for a first refresh
+    coordinator.async_set_updated_data(devices_list)
 
     hass.data.setdefault(DOMAIN, {})
     hass.data[DOMAIN][config_entry.entry_id] = coordinator
 
-    await hass.config_entries.async_forward_entry_setups(config_entry, PLATFORMS)
+    if not hass.services.has_service(DOMAIN, SERVICE_WAIT_FOR_CONFIRMATION):
+        hass.services.async_register(
+            DOMAIN,
+            SERVICE_WAIT_FOR_CONFIRMATION,
+            functools.partial(async_wait_for_confirmation, hass),
+            schema=WAIT_FOR_CONFIRMATION_SCHEMA,
+        )
 
-    # calling websocket connection to get push updates
-    
-    hass.async_create_background_task(
-      pixiepluslogin.pixie_websocket_connect(hass, config, session_data, coordinator),
-      "Pixie Plus WebSocket Connection"
+    # the websocket is opened while the platforms are set up
+    config_entry.async_create_background_task(
+        hass,
+        coordinator.async_reconcile(restored is not None),
+        "Pixie Plus startup reconcile",
     )
 
-    #asyncio.create_task(
-    #    pixiepluslogin.pixie_websocket_connect(config, session_data, coordinator)
-    #)
-
+    forwarding = time.monotonic()
+    await hass.config_entries.async_forward_entry_setups(config_entry, PLATFORMS)
+    _LOGGER.debug(
+        "setup stage platforms took %.2fs, setup took %.2fs",
+        time.monotonic() - forwarding,
+        time.monotonic() - started,
+    )
 
     return True
 
 
+async def async_wait_for_confirmation(hass: HomeAssistant, call: ServiceCall) -> None:
+    """Wait until the last commands to the given entities are confirmed.
+
+    Lets automations sequence commands without fixed delays. Fails if a
+    command was rolled back or the timeout passed first.
+    """
+    selected = async_extract_referenced_entity_ids(hass, call)
+    entity_ids = []
+    waits = []
+    for coordinator in hass.data.get(DOMAIN, {}).values():
+        if not isinstance(coordinator, MyCoordinator):
+            continue
+        for entity_id in selected.referenced | selected.indirectly_referenced:
+            key = coordinator.entity_keys.get(entity_id)
+            if key is not None:
+                entity_ids.append(entity_id)
+                waits.append(coordinator.pending.async_wait(key, call.data[ATTR_TIMEOUT]))
+
+    # areas and devices may hold other entities, named entities have to be ours
+    unknown = sorted(selected.referenced.difference(entity_ids))
+    if unknown:
+        raise HomeAssistantError(f"{', '.join(unknown)} are not Pixie Plus entities")
+
+    results = await asyncio.gather(*waits)
+    unconfirmed = [
+        entity_id for entity_id, confirmed in zip(entity_ids, results) if not confirmed
+    ]
+    if unconfirmed:
+        raise HomeAssistantError(
+            f"Commands to {', '.join(unconfirmed)} were not confirmed"
+        )
+
+
 def setup(hass: HomeAssistant, config: ConfigType) -> bool:
     """Set up the Pixie Plus Cover component from configuration.yaml"""
 
@@ -106,6 +215,9 @@ def setup(hass: HomeAssistant, config: ConfigType) -> bool:
 
     hass.data[DOMAIN] = config[DOMAIN]
 
+    if CONF_CLOUD_URL in config[DOMAIN]:
+        pixiepluslogin.configure_cloud(config[DOMAIN][CONF_CLOUD_URL])
+
     # hass.helpers.discovery.load_platform("cover", DOMAIN, {}, config)
 
     return True
@@ -114,7 +226,7 @@ def setup(hass: HomeAssistant, config: ConfigType) -> bool:
 class MyCoordinator(DataUpdateCoordinator):
     """My custom coordinator."""
 
-    def __init__(self, hass, config, session_data, devices_list):
+    def __init__(self, hass, config, session, devices_list, entry_id, snapshot):
         """Initialize my coordinator."""
         super().__init__(
             hass,
@@ -126,14 +238,120 @@ class MyCoordinator(DataUpdateCoordinator):
         )
         self.hass = hass
         self.config = config
-        self.session_data = session_data
+        self.session = session
         self.devices_list = devices_list
+        self.entry_id = entry_id
         self.platforms = []
+        # the http connection pool and the websocket are shared with the other entries
+        self.manager = async_get_manager(hass)
+        self.transport = self.manager.transport
+        self.commands = CommandQueue(hass)
+        self.latency = LatencyStats()
+        self.pending = PendingCommands(hass, self)
+        # entity_id -> device key, for the services
+        self.entity_keys = {}
+        self.connection = None
+        self.snapshot = snapshot
+        # device keys waiting for the next batched state write
+        self.state_write_window = hass.data.get(DOMAIN, {}).get(
+            CONF_STATE_WRITE_WINDOW, STATE_WRITE_WINDOW
+        )
+        self._dirty_keys = set()
+        self._unsub_flush = None
+        self.writes_deduplicated = 0
+        # a renewed token is worth persisting too
+        session.token_listeners.append(self._async_save_snapshot)
+
+    async def async_reconcile(self, restored):
+        """Start push updates and bring a restored device list up to date."""
+        # the persisted token may have been too old to be reused. if the login fails here the
+        # next request tries again
+        await pixiepluslogin.ensure_session(self.hass, self.session)
+
+        # calling websocket connection to get push updates
+        self.connection = self.manager.async_add(self)
+
+        if restored:
+            await self.async_refresh()
+        else:
+            self._async_save_snapshot()
+
+    @callback
+    def _async_save_snapshot(self):
+        self.snapshot.async_schedule_save(self.devices_list)
+
+    def device_signal(self, key):
+        """Return the dispatcher signal for updates of one device."""
+        return SIGNAL_DEVICE_UPDATE.format(self.entry_id, "_".join(map(str, key)))
+
+    @callback
+    def async_update_devices(self, keys):
+        """Notify only the entities bound to the changed devices.
+
+        The notifications are batched: keys gathered within the state write
+        window are sent once each in a single loop iteration, so a scene that
+        moves many devices over several messages writes every entity once.
+        async_set_updated_data wakes every entity and is kept for full resyncs.
+        """
+        if not keys:
+            return
+        self.writes_deduplicated += len(self._dirty_keys.intersection(keys))
+        self._dirty_keys.update(keys)
+        if self._unsub_flush is None:
+            if self.state_write_window:
+                self._unsub_flush = async_call_later(
+                    self.hass, self.state_write_window, self._async_flush_devices
+                )
+            else:
+                # still waits for the rest of the message being processed
+                self._unsub_flush = self.hass.loop.call_soon(
+                    self._async_flush_devices
+                ).cancel
+        self._async_save_snapshot()
+
+    @callback
+    def _async_flush_devices(self, _now=None):
+        self._unsub_flush = None
+        keys, self._dirty_keys = self._dirty_keys, set()
+        for key in keys:
+            async_dispatcher_send(self.hass, self.device_signal(key))
+
+    @callback
+    def async_flush_devices(self):
+        """Send the batched device updates now instead of at the end of the window."""
+        if self._unsub_flush is not None:
+            self._unsub_flush()
+        self._async_flush_devices()
+
+    @callback
+    def _async_cancel_flush(self):
+        if self._unsub_flush is not None:
+            self._unsub_flush()
+            self._unsub_flush = None
+        self._dirty_keys.clear()
+
+    @callback
+    def async_update_listeners(self) -> None:
+        """Update every entity, which makes the batched device writes redundant."""
+        self._async_cancel_flush()
+        super().async_update_listeners()
+
+    async def async_shutdown(self) -> None:
+        """Drop the batched writes and the pending confirmations of an unloaded entry."""
+        self._async_cancel_flush()
+        self.pending.async_cancel_all()
+        await super().async_shutdown()
 
     async def _async_update_data(self):
-        self.devices_list = await pixiepluslogin.getdevices(
-            self.hass, self.config, self.session_data
+        # the store is updated in place so entities stay bound to their keys
+        devices_list = await pixiepluslogin.getdevices(
+            self.hass, self.session, self.devices_list
         )
+        if devices_list is None:
+            raise UpdateFailed("Unable to get Pixie Plus devices")
+        self.devices_list = devices_list
+        self.pending.async_home_updated()
+        self._async_save_snapshot()
         return self.devices_list
 
 
@@ -144,6 +362,20 @@ async def async_unload_entry(
     if unload_ok := await hass.config_entries.async_unload_platforms(
         config_entry, PLATFORMS
     ):
-        hass.data[DOMAIN].pop(config_entry.entry_id)
+        coordinator = hass.data[DOMAIN].pop(config_entry.entry_id)
+        await coordinator.async_shutdown()
+        await coordinator.manager.async_remove(coordinator)
+        if not any(
+            isinstance(entry_data, MyCoordinator)
+            for entry_data in hass.data[DOMAIN].values()
+        ):
+            hass.services.async_remove(DOMAIN, SERVICE_WAIT_FOR_CONFIRMATION)
 
     return unload_ok
+
+
+async def async_remove_entry(
+    hass: HomeAssistant, config_entry: config_entries.ConfigEntry
+) -> None:
+    """Remove the persisted snapshot of a deleted config entry."""
+    await PixieSnapshot(hass, config_entry.entry_id).async_remove()
@@ -0,0 +1 @@
+"""Benchmarks for the Pixie Plus integration, see replay.py."""
@@ -0,0 +1,290 @@
+"""Local stand-in for the Pixie cloud, for load testing without pixie.app.
+
+Serves the Parse endpoints the integration uses (login, userQuery, Home,
+LiveGroup and the LiveGroup PUT) and the LiveQuery websocket, for one
+synthetic home (see payloads.py). A simulated bridge echoes every bleData
+command back as a LiveGroup update after a configurable latency, and applies
+it to the onlineList, which goes out as a Home update. Commands can be
+dropped at random to exercise the rollback path.
+
+    python -m benchmarks.fake_cloud --devices 200 --latency 0.3 --drop-rate 0.02
+
+Then point the integration at it in configuration.yaml and add it with any
+email and password:
+
+    pixie_plus:
+      cloud_url: http://127.0.0.1:8765
+
+GET /stats returns the command counters, and they are logged every 10 seconds.
+Needs aiohttp, which comes with Home Assistant.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+import logging
+import random
+import secrets
+
+from aiohttp import WSMsgType, web
+
+from .integration import submodule
+from .payloads import HOME_ID, LIVEGROUP_ID, USER_ID, SyntheticHome
+
+_LOGGER = logging.getLogger(__name__)
+
+PARSE = "/p0/pixieCloud"
+BRIDGE_NAME = "benchBridge"
+INVALID_SESSION = {"code": 209, "error": "Invalid session token"}
+
+
+def now_iso():
+    """Return the current time the way Parse formats dates."""
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace(
+        "+00:00", "Z"
+    )
+
+
+class FakeCloud:
+    """State of the fake cloud: sessions, the home and the LiveQuery clients."""
+
+    def __init__(self, devices, latency, jitter, drop_rate, seed) -> None:
+        """Initialize the cloud."""
+        self.codec = submodule("codec")
+        self.home = SyntheticHome(devices, seed)
+        self.updated_at = now_iso()
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.tokens = set()
+        # websocket -> {requestId: (className, where)}
+        self.clients = {}
+        self.stats = {
+            "logins": 0,
+            "commands": 0,
+            "echoed": 0,
+            "dropped": 0,
+            "home_updates": 0,
+            "rejected_sessions": 0,
+        }
+
+    def home_object(self):
+        """Return the Home object with the current onlineList."""
+        return {
+            "objectId": HOME_ID,
+            "createdAt": "2024-01-01T00:00:00.000Z",
+            "updatedAt": self.updated_at,
+            "deviceList": self.home.device_list,
+            "onlineList": self.home.online_list,
+        }
+
+    def authorized(self, request):
+        """Return True if the request carries a token handed out by login."""
+        if request.headers.get("x-parse-session-token") in self.tokens:
+            return True
+        self.stats["rejected_sessions"] += 1
+        return False
+
+    # REST
+
+    async def user_query(self, request):
+        """Every user exists."""
+        return web.json_response({"result": 1})
+
+    async def login(self, request):
+        """Hand out a new session token for any credentials."""
+        token = "r:" + secrets.token_hex(16)
+        self.tokens.add(token)
+        self.stats["logins"] += 1
+        return web.json_response(
+            {
+                "objectId": USER_ID,
+                "sessionToken": token,
+                "curHome": {"objectId": HOME_ID},
+            }
+        )
+
+    async def homes(self, request):
+        """Answer classes/Home queries, honouring objectId, updatedAt $gt, skip and limit."""
+        if not self.authorized(request):
+            return web.json_response(INVALID_SESSION, status=400)
+        where = json.loads(request.query.get("where") or "{}")
+        results = [self.home_object()]
+        if where.get("objectId", HOME_ID) != HOME_ID:
+            results = []
+        newer_than = where.get("updatedAt", {}).get("$gt", {}).get("iso")
+        if newer_than and self.updated_at <= newer_than:
+            results = []
+        skip = int(request.query.get("skip", 0))
+        limit = int(request.query.get("limit", 100))
+        return web.json_response({"results": results[skip : skip + limit]})
+
+    async def livegroups(self, request):
+        """Answer the LiveGroup lookup of the home."""
+        if not self.authorized(request):
+            return web.json_response(INVALID_SESSION, status=400)
+        return web.json_response(
+            {"results": [{"objectId": LIVEGROUP_ID, "Online": [BRIDGE_NAME]}]}
+        )
+
+    async def livegroup_command(self, request):
+        """Accept a bleData command and let the bridge act on it later."""
+        if not self.authorized(request):
+            return web.json_response(INVALID_SESSION, status=400)
+        body = await request.json()
+        self.stats["commands"] += 1
+        frame = body["Request"]["data"]["data"]
+        asyncio.get_running_loop().create_task(self._bridge(frame))
+        return web.json_response({"updatedAt": now_iso()})
+
+    async def stats_view(self, request):
+        """Return the counters."""
+        return web.json_response(dict(self.stats, clients=len(self.clients)))
+
+    # bridge
+
+    async def _bridge(self, frame):
+        await asyncio.sleep(
+            max(0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        )
+        if self.random.random() < self.drop_rate:
+            self.stats["dropped"] += 1
+            return
+
+        self.stats["echoed"] += 1
+        await self.publish(
+            "LiveGroup",
+            {
+                "objectId": LIVEGROUP_ID,
+                "Result": {"data": {"type": "bleData", "data": frame}},
+            },
+        )
+
+        if self._apply(frame):
+            self.updated_at = now_iso()
+            self.stats["home_updates"] += 1
+            await self.publish("Home", self.home_object())
+
+    def _apply(self, frame):
+        # updates the onlineList from the decoded command, True if anything moved
+        changed = False
+        for record in self.codec.decode_records(frame):
+            entry = self.home.online_list.get(str(record.mac_id))
+            if entry is None or record.usb or record.on is None:
+                continue
+            if record.side:
+                bit = 1 if record.side == "left" else 2
+                relays = entry.get("r", 0)
+                entry["r"] = relays | bit if record.on else relays & ~bit
+            elif record.brightness is not None:
+                entry["br"] = round(record.brightness / 255 * 100)
+            else:
+                entry["br"] = 100 if record.on else 0
+            changed = True
+        return changed
+
+    # LiveQuery
+
+    async def publish(self, class_name, update_object):
+        """Send an update to every subscription it matches."""
+        for websocket, subscriptions in list(self.clients.items()):
+            for request_id, (subscribed_class, where) in subscriptions.items():
+                if subscribed_class != class_name:
+                    continue
+                if where.get("objectId", update_object["objectId"]) != update_object[
+                    "objectId"
+                ]:
+                    continue
+                try:
+                    await websocket.send_json(
+                        {
+                            "op": "update",
+                            "clientId": id(websocket),
+                            "requestId": request_id,
+                            "object": update_object,
+                        }
+                    )
+                except ConnectionError:
+                    self.clients.pop(websocket, None)
+
+    async def live_query(self, request):
+        """Serve one LiveQuery client."""
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        subscriptions = self.clients[websocket] = {}
+
+        async for message in websocket:
+            if message.type != WSMsgType.TEXT:
+                continue
+            op = json.loads(message.data)
+            if op.get("op") == "connect":
+                if op.get("sessionToken") not in self.tokens:
+                    await websocket.send_json(dict(INVALID_SESSION, op="error"))
+                    continue
+                await websocket.send_json({"op": "connected", "clientId": id(websocket)})
+            elif op.get("op") == "subscribe":
+                request_id = op["requestId"]
+                if op.get("sessionToken") not in self.tokens:
+                    await websocket.send_json(
+                        dict(INVALID_SESSION, op="error", requestId=request_id)
+                    )
+                    continue
+                query = op["query"]
+                subscriptions[request_id] = (query["className"], query.get("where", {}))
+                await websocket.send_json(
+                    {"op": "subscribed", "clientId": id(websocket), "requestId": request_id}
+                )
+            elif op.get("op") == "unsubscribe":
+                subscriptions.pop(op.get("requestId"), None)
+                await websocket.send_json(
+                    {"op": "unsubscribed", "requestId": op.get("requestId")}
+                )
+
+        self.clients.pop(websocket, None)
+        return websocket
+
+    def app(self):
+        """Return the aiohttp application."""
+        app = web.Application()
+        app.router.add_post(f"{PARSE}/functions/userQuery", self.user_query)
+        app.router.add_post(f"{PARSE}/login", self.login)
+        app.router.add_get(f"{PARSE}/classes/Home", self.homes)
+        app.router.add_get(f"{PARSE}/classes/LiveGroup", self.livegroups)
+        app.router.add_put(f"{PARSE}/classes/LiveGroup/{{object_id}}", self.livegroup_command)
+        app.router.add_get("/ws/p0/pixieCloud", self.live_query)
+        app.router.add_get("/stats", self.stats_view)
+        app.on_startup.append(self._start_reporting)
+        return app
+
+    async def _start_reporting(self, app):
+        async def report():
+            while True:
+                await asyncio.sleep(10)
+                _LOGGER.info("%s", self.stats)
+
+        app["reporter"] = asyncio.get_running_loop().create_task(report())
+
+
+def main():
+    """Run the fake cloud from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.3, help="bridge echo delay (s)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="+/- random delay (s)")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="share of commands never echoed")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    cloud = FakeCloud(args.devices, args.latency, args.jitter, args.drop_rate, args.seed)
+    web.run_app(cloud.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
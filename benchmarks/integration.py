@@ -0,0 +1,34 @@
+"""Import the integration from this checkout for the benchmarks.
+
+The integration is a package with relative imports and depends on Home
+Assistant, so it is loaded by path under its domain name. Run the benchmarks
+from an environment with homeassistant installed.
+"""
+
+from __future__ import annotations
+
+import importlib
+import importlib.util
+from pathlib import Path
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+PACKAGE = "pixie_plus"
+
+
+def load_integration():
+    """Import the checkout as the pixie_plus package and return it."""
+    if PACKAGE not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            PACKAGE, ROOT / "__init__.py", submodule_search_locations=[str(ROOT)]
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[PACKAGE] = module
+        spec.loader.exec_module(module)
+    return sys.modules[PACKAGE]
+
+
+def submodule(name):
+    """Return a module of the integration, e.g. submodule("codec")."""
+    load_integration()
+    return importlib.import_module(f"{PACKAGE}.{name}")
@@ -0,0 +1,137 @@
+"""Drive a steady stream of concurrent commands through Home Assistant.
+
+Meant to run against an instance whose pixie_plus integration points at the
+fake cloud (see fake_cloud.py). Commands go through Home Assistant's REST API
+as light and switch service calls, so they take the same path as an
+automation: the entity, the command queue, the scheduler and the transport.
+
+    python -m benchmarks.load --token <long-lived token> --rate 3000 --duration 60
+
+--rate is in commands per minute. The integration's default limits (5
+commands per second) would hold such a load back, so raise them for the test
+in configuration.yaml, e.g. for 3000 a minute:
+
+    pixie_plus:
+      cloud_url: http://127.0.0.1:8765
+      command_rate: 60
+      command_burst: 100
+      command_concurrency: 16
+
+It reports the service call latency (which includes the time commands wait in
+the queue and the scheduler) and, with --cloud-url, how many commands reached
+the fake cloud, which shows how many were coalesced on the way.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import aiohttp
+
+from .integration import submodule
+
+TEMPLATE = "{{ integration_entities('pixie_plus') | select('match', 'light.|switch.') | list }}"
+
+
+async def pixie_entities(client, ha_url):
+    """Return the light and switch entities of the integration."""
+    async with client.post(f"{ha_url}/api/template", json={"template": TEMPLATE}) as response:
+        response.raise_for_status()
+        # the template renders a python style list
+        return json.loads((await response.text()).replace("'", '"'))
+
+
+def random_call(rng, entity_id):
+    """Return (domain, service, data) of a random command to entity_id."""
+    domain = entity_id.split(".", 1)[0]
+    roll = rng.random()
+    if domain == "light" and roll < 0.5:
+        # brightness changes are the ones the command queue coalesces
+        return domain, "turn_on", {"entity_id": entity_id, "brightness": rng.randint(1, 255)}
+    if roll < 0.75:
+        return domain, "turn_on", {"entity_id": entity_id}
+    return domain, "turn_off", {"entity_id": entity_id}
+
+
+async def cloud_stats(client, cloud_url):
+    """Return the counters of the fake cloud, None without one."""
+    if not cloud_url:
+        return None
+    async with client.get(f"{cloud_url}/stats") as response:
+        return await response.json()
+
+
+async def drive(args):
+    """Issue commands at the requested rate and return the summary."""
+    latency = submodule("latency").LatencyHistogram(
+        size=max(1, args.rate * args.duration // 60 + 1)
+    )
+    rng = random.Random(args.seed)
+    counters = {"sent": 0, "failed": 0}
+    slots = asyncio.Semaphore(args.concurrency)
+    headers = {"Authorization": f"Bearer {args.token}"}
+
+    async with aiohttp.ClientSession(headers=headers) as client:
+        entities = await pixie_entities(client, args.ha_url)
+        if not entities:
+            raise SystemExit("no Pixie Plus light or switch entities found")
+        before = await cloud_stats(client, args.cloud_url)
+
+        async def call(domain, service, data):
+            async with slots:
+                started = time.perf_counter()
+                try:
+                    async with client.post(
+                        f"{args.ha_url}/api/services/{domain}/{service}", json=data
+                    ) as response:
+                        ok = response.status == 200
+                except aiohttp.ClientError:
+                    ok = False
+                latency.add(time.perf_counter() - started)
+                counters["sent" if ok else "failed"] += 1
+
+        interval = 60 / args.rate
+        deadline = time.monotonic() + args.duration
+        next_call = time.monotonic()
+        tasks = set()
+        while next_call < deadline:
+            task = asyncio.ensure_future(call(*random_call(rng, rng.choice(entities))))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            next_call += interval
+            await asyncio.sleep(max(0, next_call - time.monotonic()))
+        await asyncio.gather(*tasks)
+
+        after = await cloud_stats(client, args.cloud_url)
+
+    summary = dict(counters, entities=len(entities), call_latency_ms=latency.as_dict())
+    if before is not None and after is not None:
+        summary["cloud"] = {
+            name: after[name] - before.get(name, 0)
+            for name in ("commands", "echoed", "dropped", "home_updates")
+            if name in after
+        }
+    return summary
+
+
+def main():
+    """Run the load driver from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ha-url", default="http://127.0.0.1:8123")
+    parser.add_argument("--token", required=True, help="long-lived access token")
+    parser.add_argument("--cloud-url", default="http://127.0.0.1:8765", help="fake cloud, empty to skip its stats")
+    parser.add_argument("--rate", type=int, default=3000, help="commands per minute")
+    parser.add_argument("--duration", type=int, default=60, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=50, help="service calls in flight")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(drive(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Synthetic Home and LiveGroup payloads for the benchmarks.
+
+A synthetic home cycles through every model in hardware_list, so it has
+lights, dimmers, the RGB strip, dual relays, USB plugs, covers and gateways,
+and leaves a share of the devices out of the onlineList to play offline.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+
+from .integration import submodule
+
+HOME_ID = "benchHome"
+LIVEGROUP_ID = "benchLiveGroup"
+USER_ID = "benchUser"
+
+# frames carry the device id in one byte
+MAX_MAC_ID = 255
+
+
+class SyntheticHome:
+    """A home of device_count devices and the messages the cloud sends about it."""
+
+    def __init__(self, device_count, seed=0, offline_ratio=0.1) -> None:
+        """Build the device and online lists."""
+        const = submodule("const")
+        self.codec = submodule("codec")
+        self.random = random.Random(seed)
+        self.models = sorted(const.hardware_list)
+        self.two_entities = set(const.has_two_entities)
+        self.usb = set(const.dev_has_usb)
+        self.covers = set(const.is_cover)
+        self.updated = 0
+
+        self.device_list = []
+        self.online_list = {}
+        for index in range(device_count):
+            dev_id = index + 1
+            model = self.models[index % len(self.models)]
+            device = {
+                "id": dev_id,
+                "type": int(model[:2]),
+                "stype": int(model[2:]),
+                "name": f"device {dev_id}",
+                "mac": f"a4:c1:38:{dev_id >> 16 & 0xFF:02x}:{dev_id >> 8 & 0xFF:02x}:{dev_id & 0xFF:02x}",
+            }
+            if model in self.two_entities:
+                device["left_name"] = f"device {dev_id} left"
+                device["right_name"] = f"device {dev_id} right"
+            self.device_list.append(device)
+
+            if self.random.random() >= offline_ratio:
+                self.online_list[str(dev_id)] = self._online_entry(model)
+
+    def _online_entry(self, model):
+        if model in self.two_entities:
+            return {"r": self.random.randint(0, 3)}
+        return {"br": self.random.choice((0, 0, 25, 50, 100))}
+
+    def _model(self, device):
+        return f"{device['type']:02d}{device['stype']:02d}"
+
+    def home_object(self):
+        """Return the Home object as the REST API and LiveQuery carry it."""
+        self.updated += 1
+        return {
+            "objectId": HOME_ID,
+            "updatedAt": f"2024-01-01T00:00:{self.updated % 60:02d}.{self.updated % 1000:03d}Z",
+            "deviceList": self.device_list,
+            "onlineList": dict(self.online_list),
+        }
+
+    def rest_response(self):
+        """Return a classes/Home response holding the home."""
+        return {"results": [self.home_object()]}
+
+    def home_updates(self, count, changes=3):
+        """Return count LiveQuery Home updates as json text, each moving a few devices."""
+        online = list(self.online_list)
+        messages = []
+        for _ in range(count):
+            for dev_id in self.random.sample(online, min(changes, len(online))):
+                device = self.device_list[int(dev_id) - 1]
+                self.online_list[dev_id] = self._online_entry(self._model(device))
+            messages.append(
+                json.dumps(
+                    {
+                        "op": "update",
+                        "clientId": 1,
+                        "requestId": 2,
+                        "object": self.home_object(),
+                    }
+                )
+            )
+        return messages
+
+    def livegroup_updates(self, count):
+        """Return count LiveQuery LiveGroup updates as json text.
+
+        Mixes single command echoes, multi device echoes and the short USB
+        status frames of the smart plugs.
+        """
+        codec = self.codec
+        addressable = [
+            device
+            for device in self.device_list
+            if device["id"] <= MAX_MAC_ID and self._model(device) not in self.covers
+        ]
+        plugs = [device for device in addressable if self._model(device) in self.usb]
+
+        messages = []
+        for _ in range(count):
+            roll = self.random.random()
+            if plugs and roll < 0.1:
+                plug = self.random.choice(plugs)
+                state = self.random.choice(codec.USB_STATUS_ON + codec.USB_STATUS_OFF)
+                data = (bytes(10) + bytes((plug["id"], 0, state))).hex()
+            else:
+                frame_count = 1 if roll < 0.7 else self.random.randint(2, 4)
+                data = "".join(
+                    self._command_frame(self.random.choice(addressable))
+                    for _ in range(frame_count)
+                )
+            messages.append(
+                json.dumps(
+                    {
+                        "op": "update",
+                        "clientId": 1,
+                        "requestId": 1,
+                        "object": {
+                            "objectId": LIVEGROUP_ID,
+                            "Result": {"data": {"type": "bleData", "data": data}},
+                        },
+                    }
+                )
+            )
+        return messages
+
+    def _command_frame(self, device):
+        codec = self.codec
+        model = self._model(device)
+        mac_id = device["id"]
+        on = self.random.random() < 0.5
+        if model in self.two_entities:
+            return codec.encode_switch(mac_id, on, self.random.choice(("left", "right")))
+        if model in self.usb:
+            return codec.encode_switch(mac_id, on, usb=self.random.random() < 0.3)
+        if self.random.random() < 0.5:
+            return codec.encode_level(mac_id, self.random.randint(0, 255))
+        return codec.encode_light_power(mac_id, on)
@@ -0,0 +1,247 @@
+"""Replay synthetic cloud messages through the parsers and report their cost.
+
+Usage, from an environment with homeassistant installed:
+
+    python -m benchmarks.replay
+    python -m benchmarks.replay --sizes 10 1000 --compare benchmarks/results/0.3-<time>.json
+
+For every home size it measures
+  parse_devices     building the device store from a classes/Home response
+  home_update       a LiveQuery Home update through handle_ws_update and the
+                    coordinator: batched entity writes and snapshot saves
+  livegroup_update  a LiveQuery LiveGroup update through handle_ws_update
+  json_decode       decoding the Home updates as they come off the socket, with
+                    orjson when it is installed
+  home_diff         diff_home of a Home update, the part run in a worker thread
+                    for big homes
+and reports throughput, per message p50/p95/p99 and the peak allocations.
+The updates go through the integration's real coordinator, in a Home
+Assistant instance with a temporary config directory, with a dispatcher
+listener per device standing in for the entities. The batched writes are
+flushed after every message so they are part of its cost, and the device
+store is rebuilt before each pass so every pass applies the same changes.
+Results are written to benchmarks/results/<version>-<time>.json, and
+--compare prints the change against an earlier results file.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+from pathlib import Path
+import platform
+import tempfile
+import time
+import tracemalloc
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+
+from .integration import ROOT, submodule
+from .payloads import HOME_ID, LIVEGROUP_ID, USER_ID, SyntheticHome
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+DEFAULT_SIZES = (10, 100, 1000, 5000)
+
+# keeps the pre-generated messages of the large homes in memory bounds
+MESSAGE_BUDGET = 200_000
+
+CONFIG = {
+    "email": "bench@example.com",
+    "password": "",
+    "applicationid": "bench",
+    "installationid": "bench",
+    "clientkey": "bench",
+}
+
+
+class EntityWrites:
+    """Dispatcher listeners on every device signal, counting the entity writes."""
+
+    def __init__(self, hass, coordinator) -> None:
+        """Connect a listener per device key."""
+        self.count = 0
+        for key in coordinator.data:
+            async_dispatcher_connect(hass, coordinator.device_signal(key), self._write)
+
+    def _write(self):
+        self.count += 1
+
+
+def new_coordinator(hass, session, response, seed):
+    """Return the integration's coordinator for the home in response."""
+    integration = submodule("__init__")
+    store = submodule("pixiepluslogin").parse_devices(response, session)
+    snapshot = submodule("snapshot").PixieSnapshot(hass, f"bench{seed}")
+    coordinator = integration.MyCoordinator(
+        hass, CONFIG, session, store, f"bench{seed}", snapshot
+    )
+    coordinator.data = store
+    return coordinator
+
+
+def reset_store(coordinator, response):
+    """Rebuild the device store of coordinator from response, as after a fresh fetch."""
+    store = submodule("pixiepluslogin").parse_devices(response, coordinator.session)
+    coordinator.data = coordinator.devices_list = store
+
+
+def new_session():
+    """Return a session for the synthetic home."""
+    return submodule("session").PixieSession(
+        CONFIG,
+        {
+            "userid": USER_ID,
+            "homeid": HOME_ID,
+            "sessiontoken": "bench",
+            "livegroup_objectid": LIVEGROUP_ID,
+        },
+    )
+
+
+def measure(run, items, reset=None):
+    """Time run(item) for every item, then replay once more under tracemalloc.
+
+    reset() is called before both passes, for runs that change state.
+    """
+    histogram = submodule("latency").LatencyHistogram(size=len(items))
+    if reset is not None:
+        reset()
+    started = time.perf_counter()
+    for item in items:
+        begin = time.perf_counter()
+        run(item)
+        histogram.add(time.perf_counter() - begin)
+    total = time.perf_counter() - started
+
+    if reset is not None:
+        reset()
+    tracemalloc.start()
+    for item in items:
+        run(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    summary = histogram.as_dict()
+    summary.update(
+        {
+            "total_s": round(total, 4),
+            "per_second": round(len(items) / total, 1) if total else None,
+            "peak_alloc_kib": round(peak / 1024, 1),
+        }
+    )
+    return summary
+
+
+def bench_size(hass, device_count, seed):
+    """Run every benchmark for a home of device_count devices."""
+    pixiepluslogin = submodule("pixiepluslogin")
+    messages = max(10, min(500, MESSAGE_BUDGET // device_count))
+    home = SyntheticHome(device_count, seed)
+    results = {"messages": messages}
+
+    responses = [home.rest_response() for _ in range(max(3, messages // 10))]
+    results["parse_devices"] = measure(
+        lambda response: pixiepluslogin.parse_devices(response, new_session()),
+        responses,
+    )
+
+    # the state every pass starts from, before the updates move devices
+    initial = home.rest_response()
+    coordinator = new_coordinator(hass, new_session(), initial, seed)
+    entities = EntityWrites(hass, coordinator)
+
+    def reset():
+        reset_store(coordinator, initial)
+
+    def replay(update):
+        pixiepluslogin.handle_ws_update(update, coordinator)
+        coordinator.async_flush_devices()
+
+    home_texts = home.home_updates(messages)
+    results["json_decode"] = measure(pixiepluslogin.json_loads, home_texts)
+
+    home_updates = [json.loads(text) for text in home_texts]
+    snapshot = dict(coordinator.data.snapshot)
+    results["home_diff"] = measure(
+        lambda update: pixiepluslogin.diff_home(snapshot, update["object"], True),
+        home_updates,
+    )
+    results["home_update"] = measure(replay, home_updates, reset)
+
+    livegroup_updates = [json.loads(text) for text in home.livegroup_updates(messages)]
+    results["livegroup_update"] = measure(replay, livegroup_updates, reset)
+
+    results["entity_updates"] = entities.count
+    return results
+
+
+async def run(sizes, seed):
+    """Run the benchmarks in a throwaway Home Assistant instance."""
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(config_dir)
+        hass.data[submodule("const").DOMAIN] = {}
+        try:
+            return {str(size): bench_size(hass, size, seed) for size in sizes}
+        finally:
+            await hass.async_stop(force=True)
+
+
+def compare(results, baseline):
+    """Print the change of p50 and peak allocations against a baseline run."""
+    for size, benches in results["sizes"].items():
+        base_benches = baseline.get("sizes", {}).get(size)
+        if not base_benches:
+            continue
+        for name, current in benches.items():
+            base = base_benches.get(name)
+            if not isinstance(current, dict) or not isinstance(base, dict):
+                continue
+            for metric in ("p50", "peak_alloc_kib"):
+                if current.get(metric) and base.get(metric):
+                    change = (current[metric] / base[metric] - 1) * 100
+                    print(f"{size:>6} {name:<18} {metric:<15} {change:+7.1f}%")
+
+
+def main():
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="results file to write")
+    parser.add_argument("--compare", type=Path, help="earlier results file")
+    args = parser.parse_args()
+
+    version = json.loads((ROOT / "manifest.json").read_text())["version"]
+    now = datetime.now(timezone.utc)
+    results = {
+        "version": version,
+        "time": now.isoformat(),
+        "python": platform.python_version(),
+        "json": "orjson" if submodule("pixiepluslogin").orjson else "json",
+        "sizes": {},
+    }
+
+    results["sizes"] = asyncio.run(run(args.sizes, args.seed))
+    for size in args.sizes:
+        for name, summary in results["sizes"][str(size)].items():
+            if isinstance(summary, dict):
+                print(
+                    f"{size:>6} {name:<18} {summary['per_second']:>10} msg/s"
+                    f"  p50 {summary['p50']}ms p95 {summary['p95']}ms p99 {summary['p99']}ms"
+                    f"  peak {summary['peak_alloc_kib']} KiB"
+                )
+
+    output = args.output or RESULTS_DIR / f"{version}-{now:%Y%m%dT%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"results written to {output}")
+
+    if args.compare:
+        compare(results, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Model capability registry for Pixie Plus devices."""
+
+from __future__ import annotations
+
+from enum import IntFlag
+from functools import lru_cache
+from typing import NamedTuple
+
+from .const import (
+    dev_has_usb,
+    effect_list,
+    hardware_list,
+    has_color,
+    has_dimming,
+    has_two_entities,
+    has_white,
+    is_cover,
+    is_light,
+    is_switch,
+    supported_features,
+)
+
+GATEWAY_MODEL = "0102"
+
+
+class Capability(IntFlag):
+    """What a model can do."""
+
+    LIGHT = 1
+    SWITCH = 2
+    COVER = 4
+    GATEWAY = 8
+    DIMMING = 16
+    COLOR = 32
+    WHITE = 64
+    TWO_ENTITIES = 128
+    USB = 256
+    EFFECT = 512
+    FLASH = 1024
+    TRANSITION = 2048
+
+
+class ModelCapabilities(NamedTuple):
+    """Immutable capabilities of one model, resolved once from the const tables."""
+
+    model_no: str
+    flags: Capability
+    effect_list: tuple[str, ...]
+    hardware_name: str | None
+    # the platform the model's entities belong to, None for the gateway
+    platform: str | None
+
+
+def model_number(type_, stype):
+    """Return the model number string used by the const tables, e.g. 2313."""
+    return str(type_).zfill(2) + str(stype).zfill(2)
+
+
+@lru_cache(maxsize=None)
+def get_capabilities(type_, stype):
+    """Resolve the capabilities of a (type, stype) pair, cached per pair."""
+
+    model_no = model_number(type_, stype)
+    flags = Capability(0)
+
+    for table, flag in (
+        (is_light, Capability.LIGHT),
+        (is_switch, Capability.SWITCH),
+        (is_cover, Capability.COVER),
+        (has_dimming, Capability.DIMMING),
+        (has_color, Capability.COLOR),
+        (has_white, Capability.WHITE),
+        (has_two_entities, Capability.TWO_ENTITIES),
+        (dev_has_usb, Capability.USB),
+    ):
+        if model_no in table:
+            flags |= flag
+
+    for feature in supported_features.get(model_no, ()):
+        flags |= Capability[feature]
+
+    if model_no == GATEWAY_MODEL:
+        flags |= Capability.GATEWAY
+        platform = None
+    elif Capability.SWITCH in flags:
+        platform = "switch"
+    elif Capability.COVER in flags:
+        platform = "cover"
+    else:
+        # unknown models are assumed to be lights with on/off functionality
+        platform = "light"
+
+    return ModelCapabilities(
+        model_no,
+        flags,
+        tuple(effect_list.get(model_no, ())),
+        hardware_list.get(model_no),
+        platform,
+    )
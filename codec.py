@@ -0,0 +1,216 @@
+"""Encoder and decoder for the bleData frames of the Pixie mesh.
+
+Every command frame starts with a seven byte header addressed to the device
+(its mac id is the device id), followed by an opcode, two magic bytes and the
+payload. The LiveGroup expects the frame as a hex string.
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+import struct
+from typing import NamedTuple
+
+# commands differ per device, but a home reuses the same few frames over and over
+FRAME_CACHE_SIZE = 1024
+
+OP_SWITCH = 0xC1
+OP_LEVEL = 0xC4
+OP_LIGHT_POWER = 0xED
+OP_EFFECT = 0xF8
+OP_PROGRAM = 0xFA
+
+MAGIC = b"\x69\x69"
+PROGRAM_MAGIC = b"\x6b\x69"
+
+# relay state bytes of on/off commands
+SWITCH_ON = 0x03
+SWITCH_OFF = 0x02
+RELAY_ON = {"left": 0x11, "right": 0x22}
+RELAY_OFF = {"left": 0x10, "right": 0x20}
+USB_ON = 0x0C
+USB_OFF = 0x08
+
+# state byte reported for the USB port of a smart plug
+USB_STATUS_ON = (0x0E, 0x0F)
+USB_STATUS_OFF = (0x0C, 0x0D)
+
+EFFECT_CODES = {"flash": 0x01, "strobe": 0x02, "smooth": 0x03, "fade": 0x04}
+
+WHITE = (0xFF, 0xFF, 0xFF)
+
+# offsets of the mac id and state byte in a status frame from the bridge
+STATUS_MAC_OFFSET = 10
+STATUS_STATE_OFFSET = 12
+# status frames longer than this are not single device status frames
+STATUS_FRAME_MAX_LEN = 15
+
+# bytes 1-4 of every command frame, used to find the frames in a long payload
+FRAME_MARKER = b"\x00\x00\x03\x04"
+HEADER_LEN = 7
+PAYLOAD_OFFSET = 10
+OPCODES = (OP_SWITCH, OP_LEVEL, OP_LIGHT_POWER, OP_EFFECT, OP_PROGRAM)
+
+_HEADER = struct.Struct("!B4sBB")
+_PROGRAM_BUTTON = struct.Struct("!BBBBBB")
+
+
+@lru_cache(maxsize=256)
+def frame_header(mac_id):
+    """Return the header template for the device with this mac id."""
+    return _HEADER.pack(0x00, b"\x00\x00\x03\x04", mac_id, 0x00)
+
+
+def _frame(mac_id, opcode, magic, payload):
+    return (frame_header(mac_id) + bytes((opcode,)) + magic + payload).hex()
+
+
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def encode_switch(mac_id, on, side="", usb=False):
+    """Encode an on/off command for a switch, a relay side or a USB port."""
+    if usb:
+        return _frame(
+            mac_id, OP_SWITCH, MAGIC, bytes((USB_ON if on else USB_OFF, 0, 0, 0))
+        )
+    if side:
+        state = RELAY_ON[side] if on else RELAY_OFF[side]
+        return _frame(mac_id, OP_SWITCH, MAGIC, bytes((state,)) + bytes(9))
+    return _frame(
+        mac_id, OP_SWITCH, MAGIC, bytes((SWITCH_ON if on else SWITCH_OFF, 0, 0, 0))
+    )
+
+
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def encode_light_power(mac_id, on):
+    """Encode an on/off command for a light."""
+    return _frame(mac_id, OP_LIGHT_POWER, MAGIC, bytes((int(on),)) + bytes(9))
+
+
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def encode_level(mac_id, brightness, rgb=WHITE):
+    """Encode a brightness (0-255) and colour command."""
+    return _frame(mac_id, OP_LEVEL, MAGIC, bytes((*rgb, brightness)))
+
+
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def encode_effect(mac_id, effect):
+    """Encode an effect command, unknown effects are sent as code 0."""
+    return _frame(
+        mac_id,
+        OP_EFFECT,
+        MAGIC,
+        bytes((EFFECT_CODES.get(effect, 0x00), 0x21, 0x00, 0x00, 0xFF)),
+    )
+
+
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def encode_cover_button(mac_id, button_index):
+    """Encode a press of a cover control panel button (0-8)."""
+    return _frame(
+        mac_id, OP_SWITCH, MAGIC, bytes((0, 0, 0, button_index)) + bytes(6)
+    )
+
+
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def encode_cover_program(mac_id, button):
+    """Encode a frame that programs a cover control panel button.
+
+    Button 10 closes the programming sequence.
+    """
+    if button == 10:
+        payload = _PROGRAM_BUTTON.pack(0x00, 0x01, 0x01, 0x02, 0x77, 0x00)
+    else:
+        payload = _PROGRAM_BUTTON.pack(button, 0x01, 0x01, 0x01, 0x77, 0x00)
+    return _frame(mac_id, OP_PROGRAM, PROGRAM_MAGIC, payload)
+
+
+class DecodedRecord(NamedTuple):
+    """State of one device (or relay side, or USB port) carried by a frame."""
+
+    mac_id: int
+    side: str = ""
+    usb: bool = False
+    on: bool | None = None
+    # brightness 0-255 as sent by Home Assistant, None if the frame has none
+    brightness: int | None = None
+
+
+def _split_frames(frame):
+    # a command frame is recognised by its marker, the zero after the mac id,
+    # a known opcode and its magic bytes
+    starts = []
+    index = frame.find(FRAME_MARKER, 1)
+    while index != -1:
+        start = index - 1
+        if (
+            len(frame) >= start + PAYLOAD_OFFSET
+            and frame[start + 6] == 0x00
+            and frame[start + HEADER_LEN] in OPCODES
+            and frame[start + 8 : start + PAYLOAD_OFFSET] in (MAGIC, PROGRAM_MAGIC)
+            and (not starts or start >= starts[-1] + PAYLOAD_OFFSET)
+        ):
+            starts.append(start)
+        index = frame.find(FRAME_MARKER, index + 1)
+    return [
+        frame[start:end] for start, end in zip(starts, starts[1:] + [len(frame)])
+    ]
+
+
+def _decode_frame(frame):
+    mac_id = frame[5]
+    opcode = frame[HEADER_LEN]
+    payload = frame[PAYLOAD_OFFSET:]
+    if not payload:
+        return None
+    state = payload[0]
+
+    if opcode == OP_LIGHT_POWER:
+        return DecodedRecord(mac_id, on=bool(state))
+    if opcode == OP_LEVEL and len(payload) >= 4:
+        brightness = payload[3]
+        return DecodedRecord(mac_id, on=brightness > 0, brightness=brightness)
+    if opcode == OP_SWITCH:
+        if state in (SWITCH_ON, SWITCH_OFF):
+            return DecodedRecord(mac_id, on=state == SWITCH_ON)
+        if state in (USB_ON, USB_OFF):
+            return DecodedRecord(mac_id, usb=True, on=state == USB_ON)
+        for side in RELAY_ON:
+            if state in (RELAY_ON[side], RELAY_OFF[side]):
+                return DecodedRecord(mac_id, side=side, on=state == RELAY_ON[side])
+    # cover buttons, effects and programming frames carry no state to track
+    return None
+
+
+def decode_records(update_data):
+    """Decode every device state carried by a bleData payload.
+
+    A payload is either a short status frame from the bridge (the USB port of
+    a smart plug reports this way) or one or more command frames echoed back
+    from the mesh, which carry the level, relay or on/off state of the
+    addressed devices.
+    """
+    frame = bytes.fromhex(update_data)
+
+    frames = _split_frames(frame)
+    if frames:
+        records = []
+        for command in frames:
+            record = _decode_frame(command)
+            if record is not None:
+                records.append(record)
+        return records
+
+    if STATUS_STATE_OFFSET < len(frame) <= STATUS_FRAME_MAX_LEN:
+        on = usb_status(frame[STATUS_STATE_OFFSET])
+        if on is not None:
+            return [DecodedRecord(frame[STATUS_MAC_OFFSET], usb=True, on=on)]
+    return []
+
+
+def usb_status(state_byte):
+    """Return True/False for a reported USB port state, None if unknown."""
+    if state_byte in USB_STATUS_ON:
+        return True
+    if state_byte in USB_STATUS_OFF:
+        return False
+    return None
@@ -0,0 +1,108 @@
+"""Per-device outbound command queue for Pixie Plus."""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+import logging
+
+from homeassistant.core import HomeAssistant
+
+from .const import COMMAND_COALESCE_WINDOW
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _PendingCommand:
+    """A command waiting to be sent and the callers waiting on it."""
+
+    __slots__ = ("send", "coalesce", "futures")
+
+    def __init__(self, send, coalesce, future):
+        self.send = send
+        self.coalesce = coalesce
+        self.futures = [future]
+
+
+class CommandQueue:
+    """Queue commands per device and collapse superseded level changes.
+
+    Level commands (brightness, colour, effect) are latest-wins: a new one
+    replaces a level command that is still waiting, and a device gets at most
+    one level command per window. On/off and cover commands are never dropped
+    or reordered, they act as barriers between level commands.
+    """
+
+    def __init__(self, hass: HomeAssistant, window=COMMAND_COALESCE_WINDOW) -> None:
+        """Initialize the queue."""
+        self.hass = hass
+        self.window = window
+        self._pending: dict[tuple, deque[_PendingCommand]] = {}
+        self._last_level_sent: dict[tuple, float] = {}
+        self.coalesced = 0
+
+    async def async_submit(self, key, send, coalesce=False):
+        """Queue send() for the device with this key and wait for its result.
+
+        A caller whose command was superseded gets the result of the command
+        that replaced it.
+        """
+
+        future = self.hass.loop.create_future()
+        pending = self._pending.get(key)
+
+        if pending is None:
+            pending = self._pending[key] = deque()
+            pending.append(_PendingCommand(send, coalesce, future))
+            self.hass.async_create_background_task(
+                self._async_drain(key, pending), f"Pixie Plus commands {key}"
+            )
+        elif coalesce and pending and pending[-1].coalesce:
+            tail = pending[-1]
+            tail.send = send
+            tail.futures.append(future)
+            self.coalesced += 1
+            _LOGGER.debug("coalesced command for %s", key)
+        else:
+            pending.append(_PendingCommand(send, coalesce, future))
+
+        return await future
+
+    async def _async_drain(self, key, pending):
+        loop = self.hass.loop
+        command = None
+        try:
+            while pending:
+                command = pending[0]
+                if command.coalesce:
+                    delay = (
+                        self._last_level_sent.get(key, 0) + self.window - loop.time()
+                    )
+                    if delay > 0:
+                        # newer level commands replace this one while we wait
+                        await asyncio.sleep(delay)
+                pending.popleft()
+
+                try:
+                    result = await command.send()
+                except Exception as err:  # pylint: disable=broad-except
+                    for future in command.futures:
+                        if not future.done():
+                            future.set_exception(err)
+                else:
+                    for future in command.futures:
+                        if not future.done():
+                            future.set_result(result)
+
+                if command.coalesce:
+                    self._last_level_sent[key] = loop.time()
+        finally:
+            del self._pending[key]
+            # callers still waiting here means the drain was cancelled
+            leftovers = list(pending)
+            if command is not None:
+                leftovers.append(command)
+            for leftover in leftovers:
+                for future in leftover.futures:
+                    if not future.done():
+                        future.cancel()
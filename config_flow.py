@@ -10,12 +10,14 @@ import voluptuous as vol
 
 import uuid
 
+import httpx
+
 from homeassistant import config_entries
 from homeassistant.core import HomeAssistant
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.exceptions import HomeAssistantError
 
-from .const import DOMAIN, APPLICATION_ID, CLIENT_KEY
+from .const import DOMAIN, APPLICATION_ID, CLIENT_KEY, CONF_HOME_ID
 
 
 _LOGGER = logging.getLogger(__name__)
@@ -28,31 +30,40 @@ STEP_USER_DATA_SCHEMA = vol.Schema(
 )
 
 
-async def validate_input(hass: HomeAssistant, data: dict[str, Any]) -> dict[str, Any]:
+async def validate_input(hass: HomeAssistant, data: dict[str, Any]):
     """Validate the user input allows us to connect.
 
     Data has the keys from STEP_USER_DATA_SCHEMA with values provided by the user.
+    Returns the config entry data, the homes of the account and the home last
+    opened in the app.
     """
     # If your PyPI package is not built with async, pass your methods
     # to the executor:
 
-    if not await hass.async_add_executor_job(pixiepluslogin.check_user, data):
-        raise InvalidAuth
+    try:
+        if not await hass.async_add_executor_job(pixiepluslogin.check_user, data):
+            raise InvalidAuth
+
+        res = await pixiepluslogin.login_request(hass, data)
+        if "sessionToken" not in res:
+            raise InvalidAuth
+
+        homes = await pixiepluslogin.list_homes(hass, data, res["sessionToken"])
+    except httpx.HTTPError as err:
+        raise CannotConnect from err
 
-    if (
-        await hass.async_add_executor_job(pixiepluslogin.login, hass, data)
-        == "LoginError"
-    ):
-        raise InvalidAuth
+    if not homes:
+        raise NoHomes
 
     # Return info that you want to store in the config entry.
-    return {
+    config_entry = {
         "email": data["email"],
         "password": data["password"],
         "applicationid": data["applicationid"],
         "installationid": data["installationid"],
         "clientkey": data["clientkey"]
     }
+    return (config_entry, homes, res.get("curHome", {}).get("objectId"))
 
 
 class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
@@ -66,6 +77,12 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         "clientkey": CLIENT_KEY
     }
 
+    def __init__(self) -> None:
+        """Initialize the flow."""
+        self._config_entry = {}
+        self._homes = []
+        self._current_home = None
+
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
@@ -77,25 +94,65 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             )
 
         errors = {}
-        config_entry = {}
 
         try:
             user_input.update(self.credentials)
-            config_entry = await validate_input(self.hass, user_input)
+            (
+                self._config_entry,
+                self._homes,
+                self._current_home,
+            ) = await validate_input(self.hass, user_input)
         except CannotConnect:
             errors["base"] = "cannot_connect"
         except InvalidAuth:
             errors["base"] = "invalid_auth"
+        except NoHomes:
+            errors["base"] = "no_homes"
         except Exception:  # pylint: disable=broad-except
             _LOGGER.exception("Unexpected exception")
             errors["base"] = "unknown"
         else:
-            return self.async_create_entry(title="Pixie Plus", data=config_entry)
+            if len(self._homes) == 1:
+                return await self._async_create_home_entry(self._homes[0]["objectId"])
+            return await self.async_step_home()
 
         return self.async_show_form(
             step_id="user", data_schema=STEP_USER_DATA_SCHEMA, errors=errors
         )
 
+    async def async_step_home(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Let the user pick one of the homes of the account."""
+
+        if user_input is not None:
+            return await self._async_create_home_entry(user_input[CONF_HOME_ID])
+
+        homes = {home["objectId"]: home_title(home) for home in self._homes}
+        default = self._current_home if self._current_home in homes else None
+        return self.async_show_form(
+            step_id="home",
+            data_schema=vol.Schema(
+                {vol.Required(CONF_HOME_ID, default=default): vol.In(homes)}
+            ),
+        )
+
+    async def _async_create_home_entry(self, home_id):
+        # every home of an account can be added once
+        await self.async_set_unique_id(f"{self._config_entry['email']}_{home_id}")
+        self._abort_if_unique_id_configured()
+
+        home = next(home for home in self._homes if home["objectId"] == home_id)
+        title = "Pixie Plus" if len(self._homes) == 1 else f"Pixie Plus {home_title(home)}"
+        return self.async_create_entry(
+            title=title, data={**self._config_entry, CONF_HOME_ID: home_id}
+        )
+
+
+def home_title(home):
+    """Return the name of a home, its objectId if it has none."""
+    return home.get("name") or home["objectId"]
+
 
 class CannotConnect(HomeAssistantError):
     """Error to indicate we cannot connect."""
@@ -103,3 +160,7 @@ class CannotConnect(HomeAssistantError):
 
 class InvalidAuth(HomeAssistantError):
     """Error to indicate there is invalid auth."""
+
+
+class NoHomes(HomeAssistantError):
+    """Error to indicate the account has no home."""
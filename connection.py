@@ -0,0 +1,453 @@
+"""Supervisor for the Pixie Plus LiveQuery websockets."""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import timedelta
+import json
+import logging
+import random
+import time
+
+import websockets
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+
+from .const import (
+    COMMAND_BURST,
+    COMMAND_CONCURRENCY,
+    COMMAND_RATE,
+    CONF_COMMAND_BURST,
+    CONF_COMMAND_CONCURRENCY,
+    CONF_COMMAND_RATE,
+    DATA_MANAGER,
+    DOMAIN,
+    WS_BACKOFF_MAX,
+    WS_BACKOFF_MIN,
+    WS_FALLBACK_POLL_INTERVAL,
+    WS_HANDSHAKE_TIMEOUT,
+    WS_IDLE_TIMEOUT,
+    WS_PING_TIMEOUT,
+    WS_REQUEST_STRIDE,
+)
+from .pixiepluslogin import (
+    api_url,
+    async_json_loads,
+    create_ssl_context,
+    diff_home,
+    handle_ws_update,
+    parse_offload_devices,
+    renew_session,
+    ws_handshake,
+    ws_subscribe_op,
+    ws_subscriptions,
+)
+from .scheduler import CommandScheduler
+from .session import InvalidSessionError, is_invalid_session
+from .transport import PixieTransport
+from .update_queue import UpdateQueue
+
+_LOGGER = logging.getLogger(__name__)
+
+def backoff_delay(attempt):
+    """Return the delay before reconnect attempt number attempt (0 based).
+
+    The delay doubles with every failed attempt up to WS_BACKOFF_MAX, and half
+    of it is random so many clients do not reconnect in lockstep.
+    """
+    delay = min(WS_BACKOFF_MAX, WS_BACKOFF_MIN * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+@callback
+def async_get_manager(hass: HomeAssistant):
+    """Return the connection manager shared by all config entries."""
+    data = hass.data.setdefault(DOMAIN, {})
+    if DATA_MANAGER not in data:
+        data[DATA_MANAGER] = PixieConnectionManager(hass)
+    return data[DATA_MANAGER]
+
+
+class PixieConnectionManager:
+    """Share one websocket per Pixie account, the transport and its limits between entries.
+
+    The homes of an account are multiplexed over the same LiveQuery
+    connection, every subscription carrying its own session token.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        """Initialize the manager."""
+        self.hass = hass
+        self.transport = PixieTransport(hass)
+        config = hass.data.get(DOMAIN, {})
+        self.scheduler = CommandScheduler(
+            hass,
+            config.get(CONF_COMMAND_RATE, COMMAND_RATE),
+            config.get(CONF_COMMAND_BURST, COMMAND_BURST),
+            config.get(CONF_COMMAND_CONCURRENCY, COMMAND_CONCURRENCY),
+        )
+        self._connections = {}
+        self._ssl_context = None
+
+    async def async_ssl_context(self):
+        """Return the SSL context shared by the websockets."""
+        if self._ssl_context is None:
+            self._ssl_context = await create_ssl_context(self.hass)
+        return self._ssl_context
+
+    @callback
+    def async_add(self, coordinator):
+        """Subscribe to the home of coordinator and return its connection."""
+        session = coordinator.session
+        account = (session.applicationid, session.email)
+        connection = self._connections.get(account)
+        if connection is None:
+            connection = self._connections[account] = PixieConnection(self.hass, self)
+        connection.async_add(coordinator)
+        return connection
+
+    async def async_remove(self, coordinator):
+        """Unsubscribe from the home of coordinator, closing the socket after the last one."""
+        session = coordinator.session
+        account = (session.applicationid, session.email)
+        connection = self._connections.get(account)
+        if connection is None:
+            return
+        connection.async_remove(coordinator)
+        if not connection.coordinators:
+            del self._connections[account]
+            await connection.async_stop()
+
+
+class PixieConnection:
+    """Keep the LiveQuery websocket of one Pixie account alive.
+
+    Reconnects with exponential backoff and jitter, pings the server when no
+    event arrived for a while, and falls back to polling getdevices at a
+    reduced rate while the push channel is down. The socket is read by one
+    task and the messages are decoded and applied by another, through an
+    UpdateQueue. Events are routed to the coordinator of the home they
+    belong to. When a session token is renewed
+    the socket is dropped and resubscribed with the new token right away.
+    """
+
+    def __init__(self, hass: HomeAssistant, manager) -> None:
+        """Initialize the connection."""
+        self.hass = hass
+        self.manager = manager
+        # request base -> coordinator of the home subscribed with it
+        self.coordinators = {}
+        self.connected = False
+        self._task = None
+        self._ever_connected = False
+        self._polling = False
+        self._cancel_fallback = None
+        self._websocket = None
+        # reconnect without backoff, the last drop was on purpose
+        self._resubscribe = False
+        self._next_base = 0
+        # Home or LiveGroup objectId -> coordinator, and requestId -> coordinator
+        self._routes = {}
+        self._requests = {}
+        self.queue = UpdateQueue()
+
+    @callback
+    def async_add(self, coordinator):
+        """Add the subscriptions of a home, starting the socket if needed."""
+        base = self._next_base
+        self._next_base += WS_REQUEST_STRIDE
+        self.coordinators[base] = coordinator
+        session = coordinator.session
+        session.token_listeners.append(self._async_token_renewed)
+        self._async_update_routes()
+
+        if self._task is None:
+            self._task = self.hass.async_create_background_task(
+                self._async_run(), "Pixie Plus WebSocket Connection"
+            )
+        else:
+            # also covers a handshake in progress, the ack then just goes unused
+            self._async_send(
+                [
+                    ws_subscribe_op(request_id, query, session)
+                    for request_id, query in ws_subscriptions(session, base).items()
+                ]
+            )
+
+    @callback
+    def async_remove(self, coordinator):
+        """Drop the subscriptions of a home."""
+        for base, owner in list(self.coordinators.items()):
+            if owner is not coordinator:
+                continue
+            del self.coordinators[base]
+            if self.connected:
+                self._async_send(
+                    [
+                        {"op": "unsubscribe", "requestId": request_id}
+                        for request_id in ws_subscriptions(coordinator.session, base)
+                    ]
+                )
+        if self._async_token_renewed in coordinator.session.token_listeners:
+            coordinator.session.token_listeners.remove(self._async_token_renewed)
+        self._async_update_routes()
+
+    async def async_stop(self):
+        """Stop the connection and any fallback polling."""
+        if self._cancel_fallback:
+            self._cancel_fallback()
+            self._cancel_fallback = None
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    @callback
+    def _async_update_routes(self):
+        self._routes = {}
+        self._requests = {}
+        for base, coordinator in self.coordinators.items():
+            session = coordinator.session
+            self._routes[session.homeid] = coordinator
+            self._routes[session.livegroup_objectid] = coordinator
+            for request_id in ws_subscriptions(session, base):
+                self._requests[request_id] = coordinator
+
+    def _subscriptions(self):
+        subscriptions = {}
+        for base, coordinator in self.coordinators.items():
+            session = coordinator.session
+            for request_id, query in ws_subscriptions(session, base).items():
+                subscriptions[request_id] = (query, session)
+        return subscriptions
+
+    @callback
+    def _async_send(self, ops):
+        websocket = self._websocket
+        if websocket is None:
+            return
+
+        async def _send():
+            try:
+                for op in ops:
+                    await websocket.send(json.dumps(op))
+            except websockets.ConnectionClosed:
+                # the reconnect subscribes everything again
+                pass
+
+        self.hass.async_create_task(_send())
+
+    @callback
+    def _async_route(self, ws_update, diff=None):
+        coordinator = self._find_coordinator(ws_update)
+        if coordinator is None:
+            _LOGGER.debug("websocket event for no known home: %s", ws_update)
+            return
+        handle_ws_update(ws_update, coordinator, diff)
+
+    def _find_coordinator(self, ws_update):
+        coordinator = None
+        update_object = ws_update.get("object")
+        if isinstance(update_object, dict):
+            coordinator = self._routes.get(update_object.get("objectId"))
+            if coordinator is None:
+                coordinator = self._routes.get(update_object.get("homeId"))
+        if coordinator is None:
+            coordinator = self._requests.get(ws_update.get("requestId"))
+        return coordinator
+
+    async def _async_run(self):
+        ssl_context = await self.manager.async_ssl_context()
+        attempt = 0
+        # consecutive handshakes or sockets that ended in a rejected session token
+        rejections = 0
+
+        while self.coordinators:
+            # the connect op uses the token of the first home, every subscription its own
+            session = next(iter(self.coordinators.values())).session
+            try:
+                url = api_url["websocket"]
+                async with websockets.connect(
+                    url,
+                    # a local fake cloud is plain ws
+                    ssl=ssl_context if url.startswith("wss") else None,
+                    ping_interval=None,
+                ) as websocket:
+                    self._websocket = websocket
+                    started = time.monotonic()
+                    backlog = await asyncio.wait_for(
+                        ws_handshake(websocket, session, self._subscriptions()),
+                        WS_HANDSHAKE_TIMEOUT,
+                    )
+                    _LOGGER.debug(
+                        "websocket handshake took %.2fs", time.monotonic() - started
+                    )
+                    self._async_set_connected(True)
+                    attempt = 0
+                    rejections = 0
+                    # whatever the last socket left unprocessed is older than the backlog
+                    self.queue.clear()
+
+                    # updates that arrived before the last ack are handled first, in order
+                    for ws_update in backlog:
+                        self._async_route(ws_update)
+
+                    await self._async_pump(websocket, session)
+            except InvalidSessionError as err:
+                _LOGGER.info("websocket session token rejected, renewing it")
+                self._websocket = None
+                rejected = err.session
+                rejections += 1
+                if await renew_session(self.hass, rejected, rejected.sessiontoken):
+                    self._resubscribe = True
+            except websockets.ConnectionClosed:
+                if not self._resubscribe:
+                    _LOGGER.warning("websocket disconnected, reconnecting")
+            except asyncio.TimeoutError:
+                _LOGGER.warning("websocket timed out, reconnecting")
+            except (websockets.WebSocketException, OSError) as err:
+                _LOGGER.warning("unable to connect to websocket: %s", err)
+
+            self._websocket = None
+            if self._resubscribe:
+                # the entities and polling state are kept, only the subscriptions start over
+                self._resubscribe = False
+                if rejections > 1:
+                    # the fresh token was rejected too, don't hammer the login
+                    delay = backoff_delay(attempt)
+                    attempt += 1
+                    _LOGGER.debug("resubscribing websocket in %.1f seconds", delay)
+                    await asyncio.sleep(delay)
+                continue
+
+            self._async_set_connected(False)
+            delay = backoff_delay(attempt)
+            attempt += 1
+            _LOGGER.debug("reconnecting websocket in %.1f seconds", delay)
+            await asyncio.sleep(delay)
+
+    async def _async_pump(self, websocket, session):
+        # runs the reader and the processor until either of them stops, and re-raises what stopped it
+        receiving = asyncio.ensure_future(self._async_receive(websocket))
+        processing = asyncio.ensure_future(self._async_process(session))
+        try:
+            done, _ = await asyncio.wait(
+                (receiving, processing), return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            receiving.cancel()
+            processing.cancel()
+        for task in done:
+            task.result()
+
+    async def _async_receive(self, websocket):
+        while True:
+            try:
+                ws_update = await asyncio.wait_for(websocket.recv(), WS_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                # nothing arrived for a while, make sure the link is not half dead
+                _LOGGER.debug("websocket idle, sending ping")
+                pong_waiter = await websocket.ping()
+                await asyncio.wait_for(pong_waiter, WS_PING_TIMEOUT)
+                continue
+
+            if not self.queue.put(ws_update):
+                # a dropped message may have carried state, read it all again
+                _LOGGER.warning("websocket updates are piling up, dropped the oldest")
+                for coordinator in self.coordinators.values():
+                    self.hass.async_create_task(coordinator.async_request_refresh())
+
+    async def _async_process(self, session):
+        while True:
+            ws_update = await self.queue.get()
+            try:
+                ws_update = await async_json_loads(self.hass, ws_update)
+                _LOGGER.debug(ws_update)
+            except ValueError:
+                _LOGGER.warning(
+                    "websocket data couldn't be proceesed through json.loads"
+                )
+                continue
+            if is_invalid_session(ws_update):
+                owner = self._requests.get(ws_update.get("requestId"))
+                raise InvalidSessionError(
+                    owner.session if owner else session, ws_update.get("error")
+                )
+            self._async_route(ws_update, await self._async_diff_large_home(ws_update))
+            # lets the reader and everything else run between two updates
+            await asyncio.sleep(0)
+
+    async def _async_diff_large_home(self, ws_update):
+        # a big Home snapshot is compared with the store in a worker thread,
+        # only the resulting diff is applied on the loop
+        update_object = ws_update.get("object")
+        if (
+            ws_update.get("op") != "update"
+            or not isinstance(update_object, dict)
+            or not update_object.get("onlineList")
+            or len(update_object.get("deviceList") or ())
+            <= parse_offload_devices(self.hass)
+        ):
+            return None
+        coordinator = self._find_coordinator(ws_update)
+        if coordinator is None:
+            return None
+        try:
+            return await self.hass.async_add_executor_job(
+                diff_home, dict(coordinator.data.snapshot), update_object, True
+            )
+        except (KeyError, TypeError, ValueError):
+            # handle_ws_update parses it again on the loop and logs what is wrong
+            return None
+
+    @callback
+    def _async_token_renewed(self):
+        # the subscriptions were made with the old token
+        if self._websocket is None:
+            return
+        _LOGGER.debug("session token renewed, resubscribing websocket")
+        self._resubscribe = True
+        self.hass.async_create_task(self._websocket.close())
+
+    @callback
+    def _async_set_connected(self, connected):
+        if connected == self.connected:
+            # a socket that never came up still has to fall back to polling
+            if connected or self._cancel_fallback or self._polling:
+                return
+        self.connected = connected
+        coordinators = list(self.coordinators.values())
+
+        if connected:
+            if self._cancel_fallback:
+                self._cancel_fallback()
+                self._cancel_fallback = None
+            if self._polling:
+                _LOGGER.info("websocket is back, stopping fallback polling")
+                self._polling = False
+                for coordinator in coordinators:
+                    coordinator.update_interval = None
+            if self._ever_connected:
+                # pushes may have been missed while the link was down
+                for coordinator in coordinators:
+                    self.hass.async_create_task(coordinator.async_request_refresh())
+            self._ever_connected = True
+        else:
+            # short drops are covered by the reconnect, polling starts only if it takes a while
+            self._cancel_fallback = async_call_later(
+                self.hass, WS_FALLBACK_POLL_INTERVAL, self._async_start_polling
+            )
+
+    @callback
+    def _async_start_polling(self, _now):
+        self._cancel_fallback = None
+        if self.connected:
+            return
+        _LOGGER.info(
+            "websocket is down, polling devices every %s seconds",
+            WS_FALLBACK_POLL_INTERVAL,
+        )
+        self._polling = True
+        for coordinator in self.coordinators.values():
+            coordinator.update_interval = timedelta(seconds=WS_FALLBACK_POLL_INTERVAL)
+            self.hass.async_create_task(coordinator.async_request_refresh())
@@ -38,3 +38,64 @@ supported_features = {
 effect_list = {
     "2702": ["flash", "strobe", "fade", "smooth"],
 }
+
+# timeouts (seconds) for commands sent to the LiveGroup
+COMMAND_TIMEOUT = 10
+COMMAND_CONNECT_TIMEOUT = 5
+
+# seconds an optimistic state waits for the bridge to confirm it before it is rolled back
+COMMAND_CONFIRM_TIMEOUT = 10
+
+# level commands (brightness, colour, effect) to one device are sent at most once per window (seconds)
+COMMAND_COALESCE_WINDOW = 0.3
+
+# outbound command limits shared by all entries: a token bucket of COMMAND_BURST
+# commands refilled at COMMAND_RATE per second, with COMMAND_CONCURRENCY PUTs in flight
+CONF_COMMAND_RATE = "command_rate"
+CONF_COMMAND_BURST = "command_burst"
+CONF_COMMAND_CONCURRENCY = "command_concurrency"
+COMMAND_RATE = 5
+COMMAND_BURST = 10
+COMMAND_CONCURRENCY = 4
+
+# dispatcher signal sent when one device changes, formatted with the entry id and device key
+SIGNAL_DEVICE_UPDATE = "pixie_plus_device_update_{}_{}"
+
+# config entry data: the Home objectId of the entry, chosen in the config flow
+CONF_HOME_ID = "home_id"
+
+# key of the connection manager shared by all config entries in hass.data[DOMAIN]
+DATA_MANAGER = "manager"
+
+# requestIds of the homes sharing a websocket are this far apart
+WS_REQUEST_STRIDE = 10
+
+# websocket messages waiting to be parsed before the oldest are dropped
+WS_QUEUE_SIZE = 256
+
+# seconds to wait for the websocket connect and subscribe acks
+WS_HANDSHAKE_TIMEOUT = 30
+
+# websocket reconnect backoff bounds (seconds)
+WS_BACKOFF_MIN = 1
+WS_BACKOFF_MAX = 300
+# seconds without any websocket event before the link is checked with a ping
+WS_IDLE_TIMEOUT = 120
+WS_PING_TIMEOUT = 10
+# seconds between getdevices polls while the websocket is down
+WS_FALLBACK_POLL_INTERVAL = 60
+
+# seconds to wait before writing the device snapshot, later changes are folded into the same write
+SNAPSHOT_SAVE_DELAY = 10
+# a persisted session token older than this (seconds) is not reused
+SESSION_CACHE_MAX_AGE = 7 * 24 * 3600
+
+# payloads bigger than this (bytes) are decoded in a worker thread
+CONF_JSON_OFFLOAD_SIZE = "json_offload_size"
+JSON_OFFLOAD_SIZE = 64 * 1024
+# Home objects with more devices than this are diffed against the store in a worker thread
+CONF_PARSE_OFFLOAD_DEVICES = "parse_offload_devices"
+PARSE_OFFLOAD_DEVICES = 200
+
+# seconds entity state writes are gathered for, each entity is written once per window
+STATE_WRITE_WINDOW = 0.05
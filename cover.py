@@ -32,7 +32,8 @@ from homeassistant.helpers.dispatcher import async_dispatcher_connect
 
 from typing import Any
 
-from .const import DOMAIN, hardware_list, is_cover, has_two_entities
+from .const import DOMAIN
+from .entity import PixiePlusEntity
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -64,8 +65,8 @@ async def async_setup_entry(
     config = hass.data[DOMAIN]
 
     cover_exists = 0
-    for ent in coordinator.data:
-        if (str(ent["type"]).zfill(2) + str(ent["stype"]).zfill(2)) in is_cover:
+    for ent in coordinator.data.values():
+        if ent.caps.platform == "cover":
             cover_exists = 1
 
     # adding entities
@@ -75,9 +76,9 @@ async def async_setup_entry(
         ):  # checking that user added cover config in configuration.yaml
             cover_config = config["cover"]
             async_add_entities(
-                PixiePlusCover(coordinator, idx, cover_config)
-                for idx, ent in enumerate(coordinator.data)
-                if (str(ent["type"]).zfill(2) + str(ent["stype"]).zfill(2)) in is_cover
+                PixiePlusCover(coordinator, key, cover_config)
+                for key, ent in coordinator.data.items()
+                if ent.caps.platform == "cover"
             )
         else:
             _LOGGER.info(
@@ -85,34 +86,26 @@ async def async_setup_entry(
             )
 
 
-class PixiePlusCover(CoordinatorEntity, CoverEntity):
+class PixiePlusCover(PixiePlusEntity, CoverEntity):
     """Representation of a Pixie Plus Cover."""
 
-    def __init__(self, coordinator, idx, cover_config):
+    def __init__(self, coordinator, key, cover_config):
         """Initialize a Pixie Plus Cover."""
 
-        super().__init__(coordinator)
-        self.idx = idx
-        self._mac = self.coordinator.data[self.idx]["mac"]
-        self._id = self.coordinator.data[self.idx]["id"]
-        self._type = self.coordinator.data[self.idx]["type"]
-        self._stype = self.coordinator.data[self.idx]["stype"]
-        self._email = self.coordinator.data[self.idx]["email"]
-        self._applicationid = self.coordinator.data[self.idx]["applicationid"]
-        self._installationid = self.coordinator.data[self.idx]["installationid"]
-        self._clientkey = self.coordinator.data[self.idx]["clientkey"]
-        self._userid = self.coordinator.data[self.idx]["userid"]
-        self._homeid = self.coordinator.data[self.idx]["homeid"]
-        self._livegroup_objectid = self.coordinator.data[self.idx]["livegroup_objectid"]
-        self._sessiontoken = self.coordinator.data[self.idx]["sessiontoken"]
+        super().__init__(coordinator, key)
+        self._mac = self._device.mac
+        self._id = self._device.id
+        self._type = self._device.type
+        self._stype = self._device.stype
         self._attr_has_entity_name = True
-        self._model_no = str(self._type).zfill(2) + str(self._stype).zfill(2)
+        self._model_no = self._caps.model_no
         self._attr_unique_id = self._mac
         self._attr_name = None
-        self._cover_name = (
-            self.coordinator.data[self.idx]["name"].replace(" ", "_").lower()
-        )
+        self._cover_name = self._device.name.replace(" ", "_").lower()
         self._attr_supported_features = []
+        self._cover_open = ""
+        self._cover_close = ""
+        self._cover_stop = ""
         if self._cover_name in cover_config:
             if "open" in cover_config[self._cover_name]:
                 self._cover_open = cover_config[self._cover_name]["open"]
@@ -140,14 +133,22 @@ class PixiePlusCover(CoordinatorEntity, CoverEntity):
                 f"Unable to setup cover {self._cover_name} because there is no matching cover entry in configuration.yaml. See documentation and check spelling or letter case"
             )
 
-        response = pixiepluslogin.initiate_cover(self)
+    async def async_added_to_hass(self) -> None:
+        # Call when entity about to be added to hass
+
+        await super().async_added_to_hass()
+        # programming the buttons takes several round trips, so it is not awaited here
+        self.hass.async_create_task(self._async_initiate_cover())
+
+    async def _async_initiate_cover(self) -> None:
+        response = await pixiepluslogin.initiate_cover(self)
         _LOGGER.debug(
             f"cover after self attribution with following response: {response}"
         )
 
     @property
     def device_info(self):
-        name = self.coordinator.data[self.idx]["name"]
+        name = self._device.name
 
         return {
             "identifiers": {
@@ -156,7 +157,7 @@ class PixiePlusCover(CoordinatorEntity, CoverEntity):
             },
             "name": name,
             "manufacturer": "SAL - Pixie Plus",
-            "model": hardware_list[self._model_no],
+            "model": self._caps.hardware_name,
             "via_device": (DOMAIN, "Pixie Plus Hub"),
         }
 
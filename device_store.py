@@ -0,0 +1,98 @@
+"""Keyed device state store for Pixie Plus."""
+
+from __future__ import annotations
+
+
+def device_key(dev_id, side="", usb=False):
+    """Return the store key of an entity: (device id, relay side, USB port)."""
+    return (dev_id, side, bool(usb))
+
+
+class PixieDevice:
+    """State of one entity's device, shared credentials live on the session."""
+
+    __slots__ = (
+        "name",
+        "id",
+        "br_cur",
+        "mac",
+        "state",
+        "type",
+        "stype",
+        "caps",
+        "master_device_name",
+        "side",
+        "has_usb",
+        "has_usb_update",
+        "session",
+    )
+
+    def __init__(self, session, **fields) -> None:
+        """Initialize the record."""
+        self.session = session
+        self.name = ""
+        self.id = None
+        self.br_cur = ""
+        self.mac = ""
+        self.state = ""
+        self.type = None
+        self.stype = None
+        self.caps = None
+        self.master_device_name = ""
+        self.side = ""
+        self.has_usb = ""
+        self.has_usb_update = ""
+        self.update(fields)
+
+    def update(self, fields):
+        """Set the given fields and return True if any of them changed."""
+        changed = False
+        for field, value in fields.items():
+            if getattr(self, field) != value:
+                setattr(self, field, value)
+                changed = True
+        return changed
+
+
+class DeviceStore(dict):
+    """Device records keyed by device_key().
+
+    Records are updated in place, so an entity keeps reading its own device
+    no matter which devices are online or in what order the cloud lists them.
+    The store also remembers what each device looked like in the last Home
+    update, so unchanged devices can be skipped without being reparsed.
+    """
+
+    def __init__(self, session) -> None:
+        """Initialize the store."""
+        super().__init__()
+        self.session = session
+        # device id -> signature of its deviceList and onlineList entries
+        self.snapshot = {}
+        # the last Home object the records were built from
+        self.home = None
+        # records were changed by something other than a Home update since
+        self.partial = False
+
+    def upsert(self, key, fields):
+        """Create a record or update the existing one from a dict of fields.
+
+        Returns True if anything in the record changed.
+        """
+        existing = self.get(key)
+        if existing is None:
+            self[key] = PixieDevice(self.session, **fields)
+            return True
+        return existing.update(fields)
+
+    def apply_partial(self, key, fields):
+        """Update a record from something other than a Home update.
+
+        Used for optimistic writes and for states decoded from LiveGroup
+        frames. The device snapshot is forgotten so the next Home update is
+        compared against the real state again, even if the cloud did not move,
+        and the next fetch is not conditional on the home having changed.
+        """
+        self.snapshot.pop(key[0], None)
+        self.partial = True
+        return self.upsert(key, fields)
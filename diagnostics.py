@@ -0,0 +1,42 @@
+"""Diagnostics support for Pixie Plus."""
+
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant import config_entries
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN
+
+TO_REDACT = {"email", "password", "applicationid", "installationid", "clientkey"}
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, config_entry: config_entries.ConfigEntry
+) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    coordinator = hass.data[DOMAIN][config_entry.entry_id]
+    connection = coordinator.connection
+
+    return {
+        "config": async_redact_data(dict(config_entry.data), TO_REDACT),
+        "devices": {
+            "_".join(map(str, key)): {
+                "model_no": device.caps.model_no,
+                "platform": device.caps.platform,
+                "state": device.state,
+                "br_cur": device.br_cur,
+            }
+            for key, device in coordinator.data.items()
+        },
+        "websocket_connected": connection.connected if connection else False,
+        "websocket_queue": connection.queue.as_dict() if connection else None,
+        "commands_coalesced": coordinator.commands.coalesced,
+        # limits and per lane wait times (ms) of the outbound command scheduler
+        "command_scheduler": coordinator.manager.scheduler.as_dict(),
+        "state_writes_deduplicated": coordinator.writes_deduplicated,
+        # milliseconds per command phase and model number
+        "latency": coordinator.latency.as_dict(),
+    }
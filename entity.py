@@ -0,0 +1,39 @@
+"""Base entity for Pixie Plus."""
+
+from __future__ import annotations
+
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+
+class PixiePlusEntity(CoordinatorEntity):
+    """An entity bound to one key of the coordinator's device store.
+
+    Besides the coordinator-wide refresh, the entity listens on its own
+    device signal, so a push that changes one device only updates the
+    entities of that device.
+    """
+
+    def __init__(self, coordinator, key) -> None:
+        """Initialize the entity."""
+        super().__init__(coordinator)
+        self._key = key
+        # records are updated in place, so the entity can hold on to its own
+        self._device = coordinator.data[key]
+        self._caps = self._device.caps
+
+    async def async_added_to_hass(self) -> None:
+        """Subscribe to updates of this device."""
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass,
+                self.coordinator.device_signal(self._key),
+                self._handle_coordinator_update,
+            )
+        )
+        # lets the services find the device behind an entity_id
+        self.coordinator.entity_keys[self.entity_id] = self._key
+        self.async_on_remove(
+            lambda: self.coordinator.entity_keys.pop(self.entity_id, None)
+        )
@@ -0,0 +1,84 @@
+"""Command latency statistics for Pixie Plus."""
+
+from __future__ import annotations
+
+from collections import deque
+
+# phases of a command, each measured from the start of change_light except encode, queue and put
+PHASE_ENCODE = "encode"
+PHASE_QUEUE = "queue"
+PHASE_PUT = "put"
+PHASE_ECHO = "echo"
+PHASE_CONFIRMED = "confirmed"
+PHASES = (PHASE_ENCODE, PHASE_QUEUE, PHASE_PUT, PHASE_ECHO, PHASE_CONFIRMED)
+
+# all device types together
+ALL_TYPES = "all"
+
+# samples kept per phase and device type, older ones are dropped
+LATENCY_SAMPLES = 500
+
+PERCENTILES = (50, 95, 99)
+
+
+def _nearest_rank(ordered, percent):
+    rank = max(0, -(-percent * len(ordered) // 100) - 1)
+    return round(ordered[rank], 3)
+
+
+class LatencyHistogram:
+    """The last LATENCY_SAMPLES durations of one phase, in milliseconds."""
+
+    __slots__ = ("samples", "count")
+
+    def __init__(self, size=LATENCY_SAMPLES) -> None:
+        """Initialize the histogram."""
+        self.samples = deque(maxlen=size)
+        # every sample ever added, the deque only holds the latest
+        self.count = 0
+
+    def add(self, seconds):
+        """Add a duration."""
+        self.samples.append(seconds * 1000)
+        self.count += 1
+
+    def percentile(self, percent):
+        """Return the percentile (nearest rank) in ms, None without samples."""
+        if not self.samples:
+            return None
+        return _nearest_rank(sorted(self.samples), percent)
+
+    def as_dict(self):
+        """Return p50/p95/p99 and the sample count."""
+        ordered = sorted(self.samples)
+        summary = {"count": self.count}
+        for percent in PERCENTILES:
+            summary[f"p{percent}"] = _nearest_rank(ordered, percent) if ordered else None
+        return summary
+
+
+class LatencyStats:
+    """Latency histograms per command phase and device type."""
+
+    def __init__(self) -> None:
+        """Initialize the statistics."""
+        self._histograms: dict[tuple[str, str], LatencyHistogram] = {}
+
+    def record(self, phase, device_type, seconds):
+        """Add a duration to the phase of device_type and to the overall one."""
+        for key in ((phase, device_type), (phase, ALL_TYPES)):
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def histogram(self, phase, device_type=ALL_TYPES):
+        """Return the histogram of a phase, None if nothing was recorded."""
+        return self._histograms.get((phase, device_type))
+
+    def as_dict(self):
+        """Return {phase: {device type: summary}}."""
+        stats = {phase: {} for phase in PHASES}
+        for (phase, device_type), histogram in sorted(self._histograms.items()):
+            stats[phase][device_type] = histogram.as_dict()
+        return stats
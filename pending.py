@@ -0,0 +1,242 @@
+"""Optimistic device states waiting to be confirmed by the Pixie bridge."""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import time
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+
+from .const import COMMAND_CONFIRM_TIMEOUT
+from .latency import PHASE_CONFIRMED, PHASE_ECHO
+
+_LOGGER = logging.getLogger(__name__)
+
+# brightness is reported in percent by the cloud and sent 0-255, so it only matches roughly
+BRIGHTNESS_TOLERANCE = 3
+
+# record fields a Home update is built from, the others can't be confirmed by it
+HOME_FIELDS = ("state", "br_cur")
+
+
+class _PendingAck:
+    """An optimistic write and the callers waiting for it to be confirmed."""
+
+    __slots__ = (
+        "key",
+        "frame",
+        "fields",
+        "previous",
+        "future",
+        "futures",
+        "cancel",
+        "started",
+        "device_type",
+    )
+
+    def __init__(self, key, frame, fields, previous, futures, started, device_type):
+        self.key = key
+        self.frame = frame
+        self.fields = fields
+        self.previous = previous
+        # the caller's own future, futures also holds those of the writes it superseded
+        self.future = futures[-1]
+        self.futures = futures
+        # the confirm timer, armed once the command is sent
+        self.cancel = None
+        # time.monotonic() when the command was issued, for the latency statistics
+        self.started = started
+        self.device_type = device_type
+
+    def cancel_timer(self):
+        if self.cancel is not None:
+            self.cancel()
+            self.cancel = None
+
+
+def matches(device, fields):
+    """Return True if the device record is in the state described by fields."""
+    for field, value in fields.items():
+        current = getattr(device, field)
+        if field == "state":
+            if bool(current) != bool(value):
+                return False
+        elif field == "br_cur":
+            try:
+                if abs(float(current) - float(value)) > BRIGHTNESS_TOLERANCE:
+                    return False
+            except (TypeError, ValueError):
+                return False
+        elif current != value:
+            return False
+    return True
+
+
+class PendingCommands:
+    """Track optimistic writes until the bridge confirms or the timeout hits.
+
+    A write is confirmed when the LiveGroup echoes the frame that was sent, or
+    when a Home update shows the device in the written state. Writes that are
+    not confirmed in time are rolled back and the devices are read again. The
+    timeout starts when the command is sent, time spent in the command queue
+    and the scheduler does not count.
+    A newer command to the same device takes over the waiters of the older
+    one, and the rollback state stays the last confirmed one.
+    """
+
+    def __init__(
+        self, hass: HomeAssistant, coordinator, timeout=COMMAND_CONFIRM_TIMEOUT
+    ) -> None:
+        """Initialize the table."""
+        self.hass = hass
+        self.coordinator = coordinator
+        self.timeout = timeout
+        self._pending: dict[tuple, _PendingAck] = {}
+
+    @callback
+    def async_track(self, key, frame, fields, started=None):
+        """Write fields optimistically and return the pending write.
+
+        Its future's result is True once the command is confirmed and False if
+        it was rolled back. started is when the command was issued. The
+        confirm timer is armed by async_sent.
+        """
+        store = self.coordinator.data
+        device = store[key]
+        future = self.hass.loop.create_future()
+
+        existing = self._pending.pop(key, None)
+        if existing is not None:
+            existing.cancel_timer()
+            previous = existing.previous
+            futures = existing.futures + [future]
+        else:
+            previous = {field: getattr(device, field) for field in fields}
+            futures = [future]
+
+        ack = self._pending[key] = _PendingAck(
+            key,
+            frame.lower(),
+            fields,
+            previous,
+            futures,
+            time.monotonic() if started is None else started,
+            device.caps.model_no,
+        )
+
+        store.apply_partial(key, fields)
+        self.coordinator.async_update_devices({key})
+        return ack
+
+    @callback
+    def async_sent(self, ack):
+        """Start the confirm timeout of a write whose command is on its way."""
+        if self._pending.get(ack.key) is not ack or ack.cancel is not None:
+            return
+        ack.cancel = async_call_later(
+            self.hass, self.timeout, functools.partial(self._async_expire, ack.key)
+        )
+
+    @callback
+    def async_failed(self, ack):
+        """Roll back a write whose command could not be sent.
+
+        Nothing happens if a newer command to the device took over since, the
+        newer one is confirmed or rolled back on its own.
+        """
+        if self._pending.get(ack.key) is ack:
+            self._async_rollback(ack.key)
+
+    @callback
+    def async_cancel_all(self):
+        """Stop tracking every write, when the entry unloads.
+
+        The timers are cancelled and the waiters get False, nothing is rolled
+        back or read again.
+        """
+        pending, self._pending = self._pending, {}
+        for ack in pending.values():
+            ack.cancel_timer()
+            for future in ack.futures:
+                if not future.done():
+                    future.set_result(False)
+
+    @callback
+    def async_frames_echoed(self, update_data):
+        """Confirm the writes whose frame is part of a LiveGroup bleData payload."""
+        if not self._pending:
+            return
+        update_data = update_data.lower()
+        for key, ack in list(self._pending.items()):
+            if ack.frame in update_data:
+                self.coordinator.latency.record(
+                    PHASE_ECHO, ack.device_type, time.monotonic() - ack.started
+                )
+                self._async_resolve(key, True)
+
+    @callback
+    def async_home_updated(self):
+        """Confirm the writes a Home update shows as applied.
+
+        Only the fields the Home onlineList carries count. USB ports are not
+        in it, their writes wait for the LiveGroup echo or the timeout.
+        """
+        store = self.coordinator.data
+        for key, ack in list(self._pending.items()):
+            # devices the update did not reparse still hold the optimistic state
+            if key[2] or key[0] not in store.snapshot:
+                continue
+            fields = {
+                field: value
+                for field, value in ack.fields.items()
+                if field in HOME_FIELDS
+            }
+            device = store.get(key)
+            if fields and device is not None and matches(device, fields):
+                self._async_resolve(key, True)
+
+    async def async_wait(self, key, timeout=None):
+        """Wait for the pending write to a device, True if there is none left."""
+        ack = self._pending.get(key)
+        if ack is None:
+            return True
+        future = self.hass.loop.create_future()
+        ack.futures.append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    @callback
+    def _async_expire(self, key, _now):
+        if key not in self._pending:
+            return
+        _LOGGER.warning("command to %s was not confirmed, rolling back", key)
+        self._async_rollback(key)
+
+    @callback
+    def _async_rollback(self, key):
+        ack = self._pending[key]
+        store = self.coordinator.data
+        device = store.get(key)
+        # a push that moved the device in the meantime knows better than the old state
+        if device is not None and matches(device, ack.fields):
+            store.apply_partial(key, ack.previous)
+            self.coordinator.async_update_devices({key})
+        self._async_resolve(key, False)
+        self.hass.async_create_task(self.coordinator.async_request_refresh())
+
+    @callback
+    def _async_resolve(self, key, confirmed):
+        ack = self._pending.pop(key)
+        ack.cancel_timer()
+        if confirmed:
+            self.coordinator.latency.record(
+                PHASE_CONFIRMED, ack.device_type, time.monotonic() - ack.started
+            )
+        for future in ack.futures:
+            if not future.done():
+                future.set_result(confirmed)
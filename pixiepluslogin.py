@@ -1,23 +1,39 @@
 import asyncio
 import datetime
+import functools
 import json
 import logging
 import time
 
 import httpx
-import websockets
 import ssl
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from homeassistant.core import HomeAssistant 
 from homeassistant.helpers.httpx_client import get_async_client 
 
+from . import codec
 from .const import (
-    dev_has_usb,
-    has_color,
-    has_dimming,
-    has_two_entities,
-    is_cover,
-    is_switch,
+    CONF_HOME_ID,
+    CONF_JSON_OFFLOAD_SIZE,
+    CONF_PARSE_OFFLOAD_DEVICES,
+    DOMAIN,
+    JSON_OFFLOAD_SIZE,
+    PARSE_OFFLOAD_DEVICES,
+)
+from .latency import PHASE_ENCODE, PHASE_PUT, PHASE_QUEUE
+from .scheduler import LANE_AUTOMATION, LANE_BACKGROUND, command_lane
+from .capabilities import Capability, get_capabilities
+from .device_store import DeviceStore, device_key
+from .session import (
+    INVALID_SESSION_TOKEN,
+    InvalidSessionError,
+    PixieSession,
+    is_invalid_session,
 )
 
 _LOGGER = logging.getLogger(__name__)
@@ -29,9 +45,49 @@ api_url = {
     "HP": "https://www.pixie.app/p0/pixieCloud/classes/HP",
     "livegroup": "https://www.pixie.app/p0/pixieCloud/classes/LiveGroup",
     "logout": "https://www.pixie.app/p0/pixieCloud/logout",
+    "websocket": "wss://www.pixie.app/ws/p0/pixieCloud:443",
 }
 
 
+def json_loads(data):
+    # orjson is several times faster on big Home objects, json is the fallback
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def configure_cloud(base_url):
+    # points every url at another Parse server, e.g. the local fake cloud in benchmarks/
+    base_url = base_url.rstrip("/")
+    ws_base = "ws" + base_url[len("http"):] if base_url.startswith("http") else base_url
+    api_url.update(
+        {
+            "userquery": base_url + "/p0/pixieCloud/functions/userQuery",
+            "login": base_url + "/p0/pixieCloud/login",
+            "home": base_url + "/p0/pixieCloud/classes/Home",
+            "HP": base_url + "/p0/pixieCloud/classes/HP",
+            "livegroup": base_url + "/p0/pixieCloud/classes/LiveGroup",
+            "logout": base_url + "/p0/pixieCloud/logout",
+            "websocket": ws_base + "/ws/p0/pixieCloud",
+        }
+    )
+    _LOGGER.warning("Using the Pixie cloud at %s", base_url)
+
+
+# homes per page when enumerating the homes of an account (the Parse maximum is 1000)
+HOME_PAGE_SIZE = 100
+# pages requested together when looking for a given home
+HOME_PAGE_CONCURRENCY = 2
+
+# the only Home fields the device store is built from
+HOME_KEYS = "deviceList,onlineList"
+
+# LiveQuery requestIds of the subscriptions
+WS_REQUEST_LIVEGROUP = 1
+WS_REQUEST_HOME = 2
+WS_REQUEST_HP = 3
+
+
 async def pixie_login(hass, config):
     # pixie plus hub is controlled from the cloud by accessing the foloowing url's
     # data required for login
@@ -42,17 +98,26 @@ async def pixie_login(hass, config):
         "clientkey": config["clientkey"],
         "email": config["email"],
         "password": config["password"],
+        CONF_HOME_ID: config.get(CONF_HOME_ID),
     }
 
-    # session data has session speicifc data: sessionToken, userId, homeId
-    session_data = await login(hass, login_data)
-
-    live_group_data = await livegroup_get_objectID(hass, config, session_data)
-    session_data.update(live_group_data)
+    # the session has session speicifc data: sessionToken, userId, homeId
+    started = time.monotonic()
+    session = PixieSession(config, await login(hass, login_data))
+    logged_in = time.monotonic()
+    _LOGGER.debug("setup stage login took %.2fs", logged_in - started)
 
-    devices_list = await getdevices(hass, config, session_data)
+    # the LiveGroup and the devices only depend on the home id and the token
+    live_group_data, devices_list = await asyncio.gather(
+        livegroup_get_objectID(hass, session), getdevices(hass, session)
+    )
+    session.livegroup_objectid = live_group_data["livegroup_objectid"]
+    session.bridge_name = live_group_data["bridge_name"]
+    _LOGGER.debug(
+        "setup stage livegroup and devices took %.2fs", time.monotonic() - logged_in
+    )
 
-    return (devices_list, session_data)
+    return (devices_list, session)
 
 
 # check if user exist as part of config flow
@@ -80,6 +145,28 @@ def check_user(data):
 
 
 async def login(hass, data):
+    res = await login_request(hass, data)
+
+    # the home chosen in the config flow, entries from before that use the home last opened
+    # in the app
+    home_id = data.get(CONF_HOME_ID)
+    if home_id is None and "curHome" in res:
+        home_id = res["curHome"]["objectId"]
+    else:
+        home_id = await gethomeid(hass, data, res["sessionToken"], home_id)
+
+    data = {
+        "userid": res["objectId"],
+        "homeid": home_id,
+        "sessiontoken": res["sessionToken"],
+        "raw": res,
+    }
+
+    return data
+
+
+async def login_request(hass, data):
+    # returns the response of the login itself, with the session token
     #_LOGGER.info(f"logging in")
     body = {"username": data["email"], "password": data["password"]}
     headers = {
@@ -101,51 +188,107 @@ async def login(hass, data):
 
     _LOGGER.debug("result of login: %s", res)
 
-    data = {
-        "userid": res["objectId"],
-        "homeid": res["curHome"]["objectId"] if "curHome" in res else await gethomeid(hass, data, res["sessionToken"]), 
-        "sessiontoken": res["sessionToken"],
-        "raw": res,
-    }
+    return res
 
-    return data
 
-async def gethomeid(hass, config, session_token):   
-    body = {"where": {}, "skip": 0, "limit": 20}
-                                 
-    headers = {                        
+def home_headers(config, session_token):
+    return {
         "x-parse-session-token": session_token,
         "x-parse-application-id": config["applicationid"],
-        "x-parse-client-key": config["clientkey"],                        
-    }                                           
-                                
-    client = get_async_client(hass, False)                          
-    req = await client.get(api_url["home"], params=body, headers=headers)
-    res = req.json()                                    
-                                                                              
-    return res["results"][0]["objectId"] 
-
-async def livegroup_get_objectID(hass, config, session_data):
+        "x-parse-client-key": config["clientkey"],
+    }
+
+
+async def list_homes(hass, config, session_token):
+    # returns the objectId and name of every home of the account, for the config flow
+    homes = []
+    async for page in iter_home_pages(
+        hass, home_headers(config, session_token), "objectId,name"
+    ):
+        homes.extend(page)
+    return homes
+
+
+async def gethomeid(hass, config, session_token, home_id=None):
+    # returns home_id if the account can see it, without one the account's only home
+    headers = home_headers(config, session_token)
+
+    if home_id is not None:
+        home = await find_home(hass, headers, home_id)
+        if home is None:
+            raise LookupError(f"Pixie Plus home {home_id} not found for this account")
+        return home["objectId"]
+
+    homes = []
+    async for page in iter_home_pages(hass, headers):
+        homes.extend(home["objectId"] for home in page)
+        if len(homes) > 1:
+            # picking one would be a guess
+            raise LookupError(
+                "This Pixie Plus account has several homes, add the integration "
+                "again to choose one"
+            )
+    if not homes:
+        raise LookupError("No Pixie Plus home found for this account")
+
+    return homes[0]
+
+
+async def find_home(hass, headers, object_id, keys="objectId"):
+    # returns the home with object_id, reading pages only until it is found
+    async for page in iter_home_pages(
+        hass, headers, keys, concurrency=HOME_PAGE_CONCURRENCY
+    ):
+        for home in page:
+            if home["objectId"] == object_id:
+                return home
+    return None
+
+
+async def iter_home_pages(
+    hass, headers, keys="objectId", page_size=HOME_PAGE_SIZE, concurrency=1
+):
+    # yields the account's homes one page at a time, in a stable order. with concurrency
+    # above 1 that many pages are requested together, only those pages are held in memory
+    client = get_async_client(hass, False)
+    skip = 0
+
+    while True:
+        responses = await asyncio.gather(
+            *(
+                client.get(
+                    api_url["home"],
+                    params={
+                        "where": "{}",
+                        "keys": keys,
+                        "order": "objectId",
+                        "skip": skip + index * page_size,
+                        "limit": page_size,
+                    },
+                    headers=headers,
+                )
+                for index in range(concurrency)
+            )
+        )
+        for response in responses:
+            page = response.json()["results"]
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+        skip += concurrency * page_size
+
+
+async def livegroup_get_objectID(hass, session):
     body = {
         "where": json.dumps(
-            {"GroupID": {"$regex": session_data["homeid"] + "$", "$options": "i"}}
+            {"GroupID": {"$regex": session.homeid + "$", "$options": "i"}}
         ),
         "limit": 2,
     }
 
-    headers = {
-        "x-parse-session-token": session_data["sessiontoken"],
-        "x-parse-application-id": config["applicationid"],
-        "x-parse-client-key": config["clientkey"],
-    }
+    res = await session_get(hass, session, api_url["livegroup"], body)
 
-    client = get_async_client(hass, False) 
-    req = await client.get(api_url["livegroup"], params=body, headers=headers)
-    res = req.json()
-    
-    #req = httpx.get(api_url["livegroup"], params=body, headers=headers)
-    #res = req.json()
-    
     _LOGGER.debug("result of livegroup: %s", res)
 
     data = {
@@ -157,753 +300,603 @@ async def livegroup_get_objectID(hass, config, session_data):
     return data
 
 
+async def renew_session(hass, session, stale_token):
+    # logs in again after the cloud rejected stale_token and hot-swaps the token on the session.
+    # concurrent callers share the one login in flight, callers that come in after the token
+    # was already renewed return straight away. returns True if a fresh token is in place
+    if session.sessiontoken != stale_token:
+        return True
+
+    if session.renewing is None:
+        session.renewing = hass.async_create_task(_relogin(hass, session))
+    renewing = session.renewing
+    try:
+        # a caller giving up must not cancel the login the others are waiting for
+        return await asyncio.shield(renewing)
+    finally:
+        if renewing.done() and session.renewing is renewing:
+            session.renewing = None
+
+
+async def ensure_session(hass, session):
+    # a session without a token (too old to be reused, or its renewal failed while the cloud
+    # was down) logs in before its next request. returns False if there is still no token
+    if session.sessiontoken is not None:
+        return True
+    return await renew_session(hass, session, None)
+
+
+async def _relogin(hass, session):
+    _LOGGER.info("Session token was rejected, logging in again")
+    try:
+        res = await login(hass, session.login_data)
+    except (LookupError, ValueError, httpx.HTTPError) as err:
+        _LOGGER.error("Login error, please reload the integration: %s", err)
+        return False
+
+    session.sessiontoken = res["sessiontoken"]
+    session.token_issued = time.time()
+    session.userid = res["userid"]
+
+    # everything holding state tied to the old token (the websocket) starts over
+    for listener in list(session.token_listeners):
+        listener()
+    return True
+
+
+async def session_get(hass, session, url, params):
+    # authenticated GET, logs in again and retries once if the session token was rejected
+    if not await ensure_session(hass, session):
+        return {"code": INVALID_SESSION_TOKEN, "error": "not logged in"}
+
+    client = get_async_client(hass, False)
+    token = session.sessiontoken
+    req = await client.get(url, params=params, headers=session.headers)
+    res = await async_json_loads(hass, req.content)
+
+    if is_invalid_session(res) and await renew_session(hass, session, token):
+        req = await client.get(url, params=params, headers=session.headers)
+        res = await async_json_loads(hass, req.content)
+
+    return res
+
+
+async def async_json_loads(hass, data):
+    # big payloads are decoded in a worker thread so they do not stall the event loop
+    offload_size = hass.data.get(DOMAIN, {}).get(CONF_JSON_OFFLOAD_SIZE, JSON_OFFLOAD_SIZE)
+    if encoded_size(data, offload_size) > offload_size:
+        return await hass.async_add_executor_job(json_loads, data)
+    return json_loads(data)
+
+
+def encoded_size(data, limit):
+    # size in bytes of REST content or websocket text. text is only encoded when its length
+    # in characters can't tell on which side of limit it is (utf-8 is 1 to 4 bytes a character)
+    if isinstance(data, str) and limit // 4 < len(data) <= limit:
+        return len(data.encode())
+    return len(data)
+
+
+def parse_offload_devices(hass):
+    # Home objects with more devices than this are diffed in a worker thread
+    return hass.data.get(DOMAIN, {}).get(CONF_PARSE_OFFLOAD_DEVICES, PARSE_OFFLOAD_DEVICES)
+
+
 def unix_time():
     return int(datetime.datetime.timestamp(datetime.datetime.now()) * 1000)
 
 
-async def getdevices(hass, config, session_data):
-    body = {"where": {}, "skip": 0, "limit": 20}
+async def getdevices(hass, session, store=None):
+    # asks for our home only, and only for the lists the store is built from. when the store
+    # already knows the home, it is only returned if it was updated since
+    where = {"objectId": session.homeid}
+    last_update = None
+    if store is not None and store.home and not store.partial:
+        last_update = store.home.get("updatedAt")
+    if last_update:
+        where["updatedAt"] = {"$gt": {"__type": "Date", "iso": last_update}}
+    body = {"where": json.dumps(where), "keys": HOME_KEYS, "limit": 1}
 
-    headers = {
-        "x-parse-session-token": session_data["sessiontoken"],
-        "x-parse-application-id": config["applicationid"],
-        "x-parse-client-key": config["clientkey"],
-    }
+    res = await session_get(hass, session, api_url["home"], body)
 
-    client = get_async_client(hass, False) 
-    req = await client.get(api_url["home"], params=body, headers=headers)
-    res = req.json()
-    
     _LOGGER.debug("result of getdevices: %s", res)
 
+    if last_update and res.get("results") == []:
+        _LOGGER.debug("home unchanged since %s", last_update)
+        return store
+
+    home = find_home_result(res, session)
+    if home is None:
+        return None
+
+    if store is None:
+        store = DeviceStore(session)
+
+    if len(home["deviceList"]) > parse_offload_devices(hass):
+        # the worker reads a copy of the snapshot, the store itself is only changed on the loop
+        diff = await hass.async_add_executor_job(diff_home, dict(store.snapshot), home)
+        apply_home_diff(store, home, diff)
+    else:
+        update_store(store, home)
+
+    return store
+
+
+def parse_devices(devices, session, store=None):
+    applic_res = find_home_result(devices, session)
+    if applic_res is None:
+        return None
+
+    if store is None:
+        store = DeviceStore(session)
 
-    #req = httpx.get(api_url["home"], params=body, headers=headers)
-    #res = req.json()
+    update_store(store, applic_res)
 
-    return parse_devices(res, config, session_data)
+    return store
 
 
-def parse_devices(devices, config, session_data):
+def find_home_result(devices, session):
+    # returns our home from a classes/Home response, None (logged) if it is unusable
     if "error" in devices:
-        if devices["code"] == 209:
+        if is_invalid_session(devices):
             return _LOGGER.error("Login error, please reload the integration")
         else:
             return _LOGGER.error(f"Error getting devices: {devices}")
 
-    numberofdevices = 0
-    devices_list = list()
-    applic_res = next(filter(lambda x: x['objectId'] == session_data["homeid"], devices["results"]))
+    applic_res = next(filter(lambda x: x['objectId'] == session.homeid, devices["results"]), None)
+
+    if applic_res is None:
+        return _LOGGER.error(f"Home {session.homeid} not found")
 
     if not applic_res["onlineList"]:
         return _LOGGER.info(f"No onlineList in update, skipping")
 
+    return applic_res
+
+
+def update_store(store, home, from_ws=False):
+    # updates the device records in place, devices that are not online keep their last known state
+    # returns the keys of the records that changed
+    return apply_home_diff(store, home, diff_home(store.snapshot, home, from_ws))
+
 
-    if "results" in devices:
-        numberofdevices = len(applic_res["deviceList"])
+def diff_home(snapshot, home, from_ws=False):
+    # works out the records a Home object changes without touching the store, so for big
+    # homes it can run in a worker thread on a copy of the snapshot.
+    # returns (signatures of the devices that moved, [(key, record, keep_state)])
+    online_list = home["onlineList"]
+    signatures = {}
+    updates = []
 
-    for i in range(numberofdevices):
-        dev_id = applic_res["deviceList"][i]["id"]
-        model_no = str(applic_res["deviceList"][i]["type"]).zfill(2) + str(
-            applic_res["deviceList"][i]["stype"]
-        ).zfill(2)
+    for device in home["deviceList"]:
+        dev_id = device["id"]
+        caps = get_capabilities(device["type"], device["stype"])
 
-        _LOGGER.debug("model_no %s", model_no)
+        if caps.platform is None:
+            continue  # skips the gateway for now, doesn't add it to the store
 
-        if model_no == "0102":
-            continue  # skips the gateway for now, doesn't add it to devices_list
+        online = online_list.get(str(dev_id))
+
+        # only devices whose onlineList entry (or name) moved since the last update are reparsed
+        signature = (
+            device["name"],
+            device.get("left_name"),
+            device.get("right_name"),
+            device["mac"],
+            caps,
+            (online.get("br"), online.get("r")) if online else None,
+        )
+        if snapshot.get(dev_id) == signature:
+            continue
+        signatures[dev_id] = signature
 
-        if model_no not in has_two_entities and model_no not in is_cover:
+        _LOGGER.debug("model_no %s", caps.model_no)
+
+        flags = caps.flags
+        if not flags & Capability.COVER:
             try:
-                if applic_res["onlineList"][str(dev_id)]["br"] > 0:
-                    state = True
-                elif applic_res["onlineList"][str(dev_id)]["br"] == 0:
-                    state = ""
-            except:
+                if flags & Capability.TWO_ENTITIES:
+                    relays = online["r"]
+                else:
+                    brightness = online["br"]
+            except (KeyError, TypeError):
                 _LOGGER.info(
                     "unable to get status for %s because it is not online",
-                    applic_res["deviceList"][i]["name"],
+                    device["name"],
                 )
                 continue
 
-        if model_no in has_dimming:
-            br_cur = (
-                int(applic_res["onlineList"][str(dev_id)]["br"]) / 100
-            ) * 255
+        if flags & Capability.DIMMING:
+            br_cur = (int(brightness) / 100) * 255
         else:
             br_cur = ""
 
-        if model_no in has_two_entities:
+        if flags & Capability.COVER:
+            state = None
+        elif flags & Capability.TWO_ENTITIES:
             # left first
-            device_name = applic_res["deviceList"][i]["left_name"]
-            master_device_name = applic_res["deviceList"][i]["name"]
+            state = True if relays in (1, 3) else ""
+        else:
+            state = True if brightness > 0 else ""
+
+        if flags & Capability.TWO_ENTITIES:
+            device_name = device["left_name"]
+            master_device_name = device["name"]
             side = "left"
-            try:
-                if (applic_res["onlineList"][str(dev_id)]["r"] == 1) or (
-                    applic_res["onlineList"][str(dev_id)]["r"] == 3
-                ):
-                    state = True
-                else:
-                    state = ""
-            except:
-                _LOGGER.info(
-                    "unable to get status for %s because it is not online",
-                    applic_res["deviceList"][i]["name"],
-                )
-                continue
         else:
-            device_name = applic_res["deviceList"][i]["name"]
+            device_name = device["name"]
             master_device_name = ""
             side = ""
 
-        if model_no in is_cover:
-            state = None
-
-        has_usb = ""
-
-        devices_list.append(
-            {
-                "name": device_name,
-                "id": applic_res["deviceList"][i]["id"],
-                "br_cur": br_cur,
-                "mac": applic_res["deviceList"][i]["mac"],
-                "state": state,
-                "type": applic_res["deviceList"][i]["type"],
-                "stype": applic_res["deviceList"][i]["stype"],
-                "email": config["email"],
-                "applicationid": config["applicationid"],
-                "installationid": config["installationid"],
-                "clientkey": config["clientkey"],
-                "userid": session_data["userid"],
-                "homeid": session_data["homeid"],
-                "livegroup_objectid": session_data["livegroup_objectid"],
-                "sessiontoken": session_data["sessiontoken"],
-                "master_device_name": master_device_name,
-                "side": side,
-                "has_usb": has_usb,
-                "has_usb_update": "",
-            }
-        )
-
-        if model_no in dev_has_usb:
-            has_usb = True
-            state = ""
-
-            devices_list.append(
-                {
-                    "name": device_name,
-                    "id": applic_res["deviceList"][i]["id"],
-                    "br_cur": br_cur,
-                    "mac": applic_res["deviceList"][i]["mac"],
-                    "state": state,
-                    "type": applic_res["deviceList"][i]["type"],
-                    "stype": applic_res["deviceList"][i]["stype"],
-                    "email": config["email"],
-                    "applicationid": config["applicationid"],
-                    "installationid": config["installationid"],
-                    "clientkey": config["clientkey"],
-                    "userid": session_data["userid"],
-                    "homeid": session_data["homeid"],
-                    "livegroup_objectid": session_data["livegroup_objectid"],
-                    "sessiontoken": session_data["sessiontoken"],
-                    "master_device_name": master_device_name,
-                    "side": side,
-                    "has_usb": has_usb,
-                    "has_usb_update": "",
-                }
+        record = {
+            "name": device_name,
+            "id": dev_id,
+            "br_cur": br_cur,
+            "mac": device["mac"],
+            "state": state,
+            "type": device["type"],
+            "stype": device["stype"],
+            "caps": caps,
+            "master_device_name": master_device_name,
+            "side": side,
+            "has_usb": "",
+            "has_usb_update": "",
+        }
+        updates.append((device_key(dev_id, side), record, False))
+
+        if flags & Capability.USB:
+            # usb state is not provided in the update so an existing state is kept
+            updates.append(
+                (
+                    device_key(dev_id, side, True),
+                    dict(record, has_usb=True, has_usb_update=from_ws, state=""),
+                    True,
+                )
             )
-        elif model_no in has_two_entities:
-            device_name = applic_res["deviceList"][i]["right_name"]
+
+        elif flags & Capability.TWO_ENTITIES:
             side = "right"
-            if (applic_res["onlineList"][str(dev_id)]["r"] == 2) or (
-                applic_res["onlineList"][str(dev_id)]["r"] == 3
-            ):
-                state = True
-            else:
-                state = ""
-
-            devices_list.append(
-                {
-                    "name": device_name,
-                    "id": applic_res["deviceList"][i]["id"],
-                    "br_cur": br_cur,
-                    "mac": applic_res["deviceList"][i]["mac"],
-                    "state": state,
-                    "type": applic_res["deviceList"][i]["type"],
-                    "stype": applic_res["deviceList"][i]["stype"],
-                    "email": config["email"],
-                    "applicationid": config["applicationid"],
-                    "installationid": config["installationid"],
-                    "clientkey": config["clientkey"],
-                    "userid": session_data["userid"],
-                    "homeid": session_data["homeid"],
-                    "livegroup_objectid": session_data["livegroup_objectid"],
-                    "sessiontoken": session_data["sessiontoken"],
-                    "master_device_name": master_device_name,
-                    "side": side,
-                    "has_usb": has_usb,
-                    "has_usb_update": "",
-                }
+            updates.append(
+                (
+                    device_key(dev_id, side),
+                    dict(
+                        record,
+                        name=device["right_name"],
+                        state=True if relays in (2, 3) else "",
+                        side=side,
+                    ),
+                    False,
+                )
             )
-    # _LOGGER.info(devices_list)
-    return devices_list
 
+    return (signatures, updates)
 
-async def change_light(data, state, other):
-    light_command_number = "00"
-    mac_id = f"{data._id:02x}"
-    model_no = str(data._type).zfill(2) + str(data._stype).zfill(2)
 
-    if (state == "on") or (state == "00"):  # for on/off command
-        if model_no in is_switch:  # for switch
-            if data._has_usb:  # for USB
-                state_command = "00"
-                if state == "on":
-                    state_command = "0c"
-                elif state == "00":
-                    state_command = "08"
-
-                light_command_data = (
-                    str(light_command_number)
-                    + "00000304"
-                    + str(mac_id)
-                    + "00c16969"
-                    + str(state_command)
-                    + "000000"
-                )
+def apply_home_diff(store, home, diff):
+    # applies the result of diff_home to the store, returns the keys of the records that changed
+    signatures, updates = diff
+    store.home = home
+    store.partial = False
+    store.snapshot.update(signatures)
 
-            else:  # for main switch
-                if (
-                    model_no in has_two_entities
-                ):  # for models with left and right sockets
-                    state_command = "00"
-                    if data._side == "left":
-                        if state == "on":
-                            state_command = "11"
-                        elif state == "00":
-                            state_command = "10"
-                    elif data._side == "right":
-                        if state == "on":
-                            state_command = "22"
-                        elif state == "00":
-                            state_command = "20"
-
-                    light_command_data = (
-                        str(light_command_number)
-                        + "00000304"
-                        + str(mac_id)
-                        + "00c16969"
-                        + str(state_command)
-                        + "000000000000000000"
-                    )
-
-                else:  # for single switch
-                    state_command = "00"
-                    if state == "on":
-                        state_command = "03"
-                    elif state == "00":
-                        state_command = "02"
-
-                    light_command_data = (
-                        str(light_command_number)
-                        + "00000304"
-                        + str(mac_id)
-                        + "00c16969"
-                        + str(state_command)
-                        + "000000"
-                    )
+    changed = set()
+    for key, record, keep_state in updates:
+        if keep_state and key in store:
+            record = dict(record)
+            del record["state"]
+        if store.upsert(key, record):
+            changed.add(key)
 
-        else:  # for light
-            state_command = "00"
-            if state == "on":
-                state_command = 1
-            elif state == "00":
-                state_command = 0
-
-            light_command_data = (
-                str(light_command_number)
-                + "00000304"
-                + str(mac_id)
-                + "00ed69690"
-                + str(state_command)
-                + "000000000000000000"
+    return changed
+
+
+async def change_light(data, state, other, optimistic=None):
+    # optimistic holds the record fields the command is expected to lead to. they are written
+    # right away and the returned future tells whether the bridge confirmed them
+    # brightness, colour and effect changes are latest-wins, on/off and cover commands keep their order
+    coalesce = state not in ("on", "00", "open", "close", "stop")
+    started = time.monotonic()
+    mac_id = data._id
+    flags = data._caps.flags
+
+    if (state == "on") or (state == "00"):  # for on/off command
+        if flags & Capability.SWITCH:  # for switch, relay sides and USB
+            light_command_data = codec.encode_switch(
+                mac_id, state == "on", data._side, bool(data._has_usb)
             )
+        else:  # for light
+            light_command_data = codec.encode_light_power(mac_id, state == "on")
     elif state == "open" or state == "close" or state == "stop":  # for cover
         if state == "open":
-            state = int(data._cover_open) - 1
+            button = data._cover_open
         elif state == "close":
-            state = int(data._cover_close) - 1
-        elif state == "stop":
-            state = int(data._cover_stop) - 1
-
-        light_command_data = (
-            str(light_command_number)
-            + "00000304"
-            + str(mac_id)
-            + "00c169690000000"
-            + str(state)
-            + "000000000000"
-        )
+            button = data._cover_close
+        else:
+            button = data._cover_stop
+
+        light_command_data = codec.encode_cover_button(mac_id, int(button) - 1)
     else:  # for chaning brightness (hex value in state to change brightness), color and other parameters
-        light_command_data = (
-            str(light_command_number)
-            + "00000304"
-            + str(mac_id)
-            + "00c46969ffffff"
-            + str(state)
-        )
+        brightness = int(state, 16)
+        light_command_data = codec.encode_level(mac_id, brightness)
 
         if other:
-            if other["rgb_color"]:
-                colors = other["rgb_color"]
-                color_command = (
-                    hex(colors[0])[2:].zfill(2)
-                    + hex(colors[1])[2:].zfill(2)
-                    + hex(colors[2])[2:].zfill(2)
-                )
-            else:
-                color_command = "ffffff"
-
             if other["effect"]:
-                effect = other["effect"]
-                effect_command = "00"
-                if effect == "flash":
-                    effect_command = "01"
-                elif effect == "strobe":
-                    effect_command = "02"
-                elif effect == "smooth":
-                    effect_command = "03"
-                elif effect == "fade":
-                    effect_command = "04"
-                light_command_data = (
-                    str(light_command_number)
-                    + "00000304"
-                    + str(mac_id)
-                    + "00f86969"
-                    + str(effect_command)
-                    + "21"
-                    + "0000ff"
-                )
-            else:
-                light_command_data = (
-                    str(light_command_number)
-                    + "00000304"
-                    + str(mac_id)
-                    + "00c46969"
-                    + color_command
-                    + str(state)
+                light_command_data = codec.encode_effect(mac_id, other["effect"])
+            elif other["rgb_color"]:
+                light_command_data = codec.encode_level(
+                    mac_id, brightness, tuple(other["rgb_color"])
                 )
 
+    coordinator = data.coordinator
+    device_type = data._caps.model_no
+    coordinator.latency.record(PHASE_ENCODE, device_type, time.monotonic() - started)
+    # a command a user asked for from the UI goes before automations
+    lane = command_lane(data._context)
+
+    ack = None
+    if optimistic is not None:
+        # tracked before sending, the echo can be quicker than the PUT response
+        ack = coordinator.pending.async_track(
+            data._key, light_command_data, optimistic, started
+        )
+
+    on_sent = None
+    if ack is not None:
+        on_sent = functools.partial(coordinator.pending.async_sent, ack)
+
+    try:
+        response = await coordinator.commands.async_submit(
+            data._key,
+            functools.partial(
+                send_ble_command,
+                coordinator,
+                data._id,
+                light_command_data,
+                coordinator.session.userid,
+                device_type=device_type,
+                lane=lane,
+                on_sent=on_sent,
+            ),
+            coalesce,
+        )
+    except asyncio.CancelledError:
+        # never sent, so no timer would ever roll the write back
+        if ack is not None:
+            coordinator.pending.async_failed(ack)
+        raise
+
+    if ack is None:
+        return None
+    if response is None or "error" in response:
+        _LOGGER.warning("command to %s failed: %s", data._key, response)
+        coordinator.pending.async_failed(ack)
+
+    return ack.future
+
+
+async def send_ble_command(
+    coordinator,
+    dev_id,
+    light_command_data,
+    sender,
+    repeat=None,
+    device_type=None,
+    lane=LANE_AUTOMATION,
+    on_sent=None,
+):
+    # wraps a bleData frame in a LiveGroup request and sends it through the shared transport,
+    # every PUT waits for its turn in the command scheduler
     bleData_request_data = {"data": light_command_data, "type": "bleData"}
+    if repeat:
+        bleData_request_data["repeat"] = repeat
     bleData_request = {
         "data": bleData_request_data,
-        "from": data._userid,
+        "from": sender,
         "time": unix_time(),
         "to": "ALL",
     }
     bleData = {"Cmd": 2, "Request": bleData_request}
-    # bleData.update(ID_param)
+
+    session = coordinator.session
 
     api_url_web_livegroup_instance = (
-        "https://www.pixie.app/p0/pixieCloud/classes/LiveGroup/"
-        + data._livegroup_objectid
+        api_url["livegroup"] + "/" + session.livegroup_objectid
     )
 
-    config = data.coordinator.config
-    session_data = data.coordinator.session_data
-
-    headers = {
-        "x-parse-session-token": session_data["sessiontoken"],
-        "x-parse-application-id": config["applicationid"],
-        "x-parse-client-key": config["clientkey"],
-    }
-
-    request = httpx.put(api_url_web_livegroup_instance, json=bleData, headers=headers)
-    _LOGGER.debug(bleData)
-    _LOGGER.debug(request.url)
-    _LOGGER.debug(request.text)
+    if not await ensure_session(coordinator.hass, session):
+        _LOGGER.warning("not logged in to the Pixie cloud, command not sent")
+        return None
+
+    # the headers are read at send time, so queued commands pick up a renewed token
+    token = session.sessiontoken
+    scheduler = coordinator.manager.scheduler
+    device = (api_url_web_livegroup_instance, dev_id)
+    async with scheduler.async_slot(lane, device) as waited:
+        if on_sent is not None:
+            # the confirm timeout only runs from here, queueing does not count against it
+            on_sent()
+        started = time.monotonic()
+        response = await coordinator.transport.async_put(
+            api_url_web_livegroup_instance, bleData, session.headers, dev_id
+        )
+    if device_type is not None:
+        coordinator.latency.record(PHASE_QUEUE, device_type, waited)
+
+    if is_invalid_session(response) and await renew_session(
+        coordinator.hass, session, token
+    ):
+        async with scheduler.async_slot(lane, device):
+            response = await coordinator.transport.async_put(
+                api_url_web_livegroup_instance, bleData, session.headers, dev_id
+            )
 
-    # json_data = json.dumps(request.json())
-    # ble_success = json.loads(json_data)
-    # TODO check success
+    if device_type is not None:
+        coordinator.latency.record(PHASE_PUT, device_type, time.monotonic() - started)
 
-    return
+    return response
 
 async def create_ssl_context(hass: HomeAssistant) -> ssl.SSLContext:
     """Create an SSL context in a non-blocking way using Home Assistant's async executor."""
     return await hass.async_add_executor_job(ssl.create_default_context)
 
-# connect to websocket to get updates
-async def pixie_websocket_connect(hass: HomeAssistant, config, session_data, coordinator):
-    # logger = logging.getLogger('websockets')
-    # logger.setLevel(logging.DEBUG)
-    # logger.addHandler(logging.StreamHandler())
-
-    api_url_web_websocket = "wss://www.pixie.app/ws/p0/pixieCloud:443"
-
-    # connect to ws
-    ws_ID_param = {
-        "applicationId": config["applicationid"],
-        "sessionToken": session_data["sessiontoken"],
-        "clientKey": config["clientkey"],
+def ws_subscriptions(session, request_base=0):
+    # LiveQuery subscriptions of one home by requestId, offset by request_base so
+    # several homes can share a websocket
+    return {
+        request_base + WS_REQUEST_LIVEGROUP: {
+            "className": "LiveGroup",
+            "where": {"objectId": session.livegroup_objectid},
+        },
+        request_base + WS_REQUEST_HOME: {
+            "className": "Home",
+            "where": {"objectId": session.homeid},
+        },
+        request_base + WS_REQUEST_HP: {
+            "className": "HP",
+            "where": {"homeId": session.homeid, "userId": session.userid},
+        },
     }
 
-    ws_connect = {"op": "connect"}
-    ws_connect.update(ws_ID_param)
 
-    # subscribe to livegroup
-    ws_subscribe_livegroup_where = {"objectId": session_data["livegroup_objectid"]}
-    ws_subscribe_livegroup_query = {
-        "className": "LiveGroup",
-        "where": ws_subscribe_livegroup_where,
-    }
-    ws_subscribe_livegroup = {
+def ws_subscribe_op(request_id, query, session):
+    return {
         "op": "subscribe",
-        "query": ws_subscribe_livegroup_query,
-        "requestId": 1,
-        "sessionToken": session_data["sessiontoken"],
+        "query": query,
+        "requestId": request_id,
+        "sessionToken": session.sessiontoken,
     }
 
-    # subscribe to home
-    ws_subscribe_home_where = {"objectId": session_data["homeid"]}
-    ws_subscribe_home_query = {"className": "Home", "where": ws_subscribe_home_where}
-    ws_subscribe_home = {
-        "op": "subscribe",
-        "query": ws_subscribe_home_query,
-        "requestId": 2,
-        "sessionToken": session_data["sessiontoken"],
-    }
 
-    # subscribe to HP
-    ws_subscribe_HP_where = {
-        "homeId": session_data["homeid"],
-        "userId": session_data["userid"],
-    }
-    ws_subscribe_HP_query = {"className": "HP", "where": ws_subscribe_HP_where}
-    ws_subscribe_HP = {
-        "op": "subscribe",
-        "query": ws_subscribe_HP_query,
-        "requestId": 3,
-        "sessionToken": session_data["sessiontoken"],
+async def ws_handshake(websocket, session, subscriptions):
+    # sends connect with the token of session and every subscribe op (requestId -> (query, session))
+    # without waiting in between, then collects the acks matching them by requestId. anything
+    # else that arrives in the meantime is returned so it can be processed once the handshake is done
+    ws_connect = {
+        "op": "connect",
+        "applicationId": session.applicationid,
+        "sessionToken": session.sessiontoken,
+        "clientKey": session.clientkey,
     }
-    
-    ssl_context = await create_ssl_context(hass)
 
-    async for websocket in websockets.connect(api_url_web_websocket, ssl=ssl_context):
+    await websocket.send(json.dumps(ws_connect))
+    for request_id, (query, owner) in subscriptions.items():
+        await websocket.send(json.dumps(ws_subscribe_op(request_id, query, owner)))
+
+    connected = False
+    pending = set(subscriptions)
+    backlog = []
+
+    while not connected or pending:
+        response = await websocket.recv()
         try:
-            await websocket.send(json.dumps(ws_connect))
-            response = await websocket.recv()
-            try:
-                response = json.loads(response)
-            except:
-                _LOGGER.debug("Websocket response unable to be processed by json.loads")
-            if "op" in response:
-                if response["op"] == "connected":
-                    _LOGGER.info("Websocket connected")
-                    print("Websocket connected")
-
-            await websocket.send(json.dumps(ws_subscribe_livegroup))
-            response = await websocket.recv()
-            try:
-                response = json.loads(response)
-            except:
-                _LOGGER.debug("Websocket response unable to be processed by json.loads")
-            if "op" in response:
-                if response["op"] == "subscribed":
-                    _LOGGER.info("Subscribed to Livegroup")
-                    print("Subscribed to Livegroup")
-
-            await websocket.send(json.dumps(ws_subscribe_home))
-            response = await websocket.recv()
-            try:
-                response = json.loads(response)
-            except:
-                _LOGGER.debug("Websocket response unable to be processed by json.loads")
-            if "op" in response:
-                if response["op"] == "subscribed":
-                    _LOGGER.info("Subscribed to home")
-                    print("Subscribed to home")
-
-            await websocket.send(json.dumps(ws_subscribe_HP))
-            response = await websocket.recv()
-            try:
-                response = json.loads(response)
-            except:
-                _LOGGER.debug("Websocket response unable to be processed by json.loads")
-            if "op" in response:
-                if response["op"] == "subscribed":
-                    _LOGGER.info("Subscribed to HP")
-                    print("Subscribed to HP")
-
-            while True:
-                ws_update = await websocket.recv()
-                # print("\nnew update\n")
-                # print(ws_update)
-                try:
-                    ws_update = json.loads(ws_update)
-                    _LOGGER.debug(ws_update)
-                except:
-                    _LOGGER.warning(
-                        "websocket data couldn't be proceesed through json.loads"
-                    )
-                    # print(json.dumps(ws_update, indent=4))
-                    # _LOGGER.info(ws_update)
-                if "op" in ws_update:
-                    if ws_update["op"] == "update":
-                        if "deviceList" in ws_update["object"]:
-                            try:
-                                # _LOGGER.info(ws_update)
-                                devices_list = parse_ws_data(
-                                    ws_update, coordinator, config, session_data
-                                )
-                                # _LOGGER.info(
-                                #    "devices_list after parsing by main ws update: %s",
-                                #    devices_list,
-                                # )
-                                # print("processed device list")
-                                # print(devices_list)
-                                if devices_list:
-                                    coordinator.async_set_updated_data(devices_list)
-                            except:
-                                _LOGGER.error("unable to parse large websocket input")
-                                _LOGGER.debug(ws_update)
-                        if ws_update["requestId"] == 1:
-                            try:
-                                # _LOGGER.info(ws_update)
-                                devices_list = parse_single_ws_update(
-                                    coordinator, ws_update
-                                )
-                                # _LOGGER.info(
-                                #    "devices_list after parsing by small ws update: %s",
-                                #    devices_list,
-                                # )
-                                if devices_list:
-                                    coordinator.async_set_updated_data(devices_list)
-                            except ValueError as toolong:
-                                _LOGGER.debug(toolong)
-                            except RuntimeError as no_data:
-                                _LOGGER.debug(no_data)
-                            except:
-                                _LOGGER.info("unable to parse small websocket input")
-                                _LOGGER.debug(ws_update)
-        except websockets.ConnectionClosed:
-            _LOGGER.warning("websocket disconnected, reconnecting")
+            response = json.loads(response)
+        except ValueError:
+            _LOGGER.debug("Websocket response unable to be processed by json.loads")
             continue
-        except websockets.TimeoutError:
-            _LOGGER.warning(
-                "unable to connect to websocket, will try again in 1 minute"
+
+        op = response.get("op")
+        if op == "connected":
+            connected = True
+            _LOGGER.info("Websocket connected")
+        elif op == "subscribed" and response.get("requestId") in pending:
+            pending.discard(response["requestId"])
+            _LOGGER.info(
+                "Subscribed to %s",
+                subscriptions[response["requestId"]][0]["className"],
             )
-            continue
+        elif op == "error":
+            if is_invalid_session(response):
+                owner = subscriptions.get(response.get("requestId"), (None, session))[1]
+                raise InvalidSessionError(owner, response.get("error"))
+            _LOGGER.warning("Websocket error during handshake: %s", response)
+            # a failed subscription is not acked, so it is not waited for
+            pending.discard(response.get("requestId"))
+        else:
+            backlog.append(response)
 
-    return
+    return backlog
 
 
-# parses websocket data as has different structure from data recivied via http to get current devices
+def handle_ws_update(ws_update, coordinator, diff=None):
+    # diff is the diff_home result of a Home update when it was already worked out off the loop
+    if "op" in ws_update:
+        if ws_update["op"] == "update":
+            if "deviceList" in ws_update["object"]:
+                try:
+                    # only the entities of changed devices are woken up
+                    changed = parse_ws_data(ws_update, coordinator, diff)
+                    coordinator.async_update_devices(changed)
+                    coordinator.pending.async_home_updated()
+                except:
+                    _LOGGER.error("unable to parse large websocket input")
+                    _LOGGER.debug(ws_update)
+            if ws_update["object"].get("objectId") == coordinator.session.livegroup_objectid:
+                try:
+                    changed = parse_single_ws_update(coordinator, ws_update)
+                    coordinator.async_update_devices(changed)
+                except ValueError as bad_frame:
+                    _LOGGER.debug("unable to decode bleData: %s", bad_frame)
+                except RuntimeError as no_data:
+                    _LOGGER.debug(no_data)
+                except:
+                    _LOGGER.info("unable to parse small websocket input")
+                    _LOGGER.debug(ws_update)
+
 
+# parses websocket data as has different structure from data recivied via http to get current devices
 
-def parse_ws_data(devices, coordinator, config, session_data):
-    numberofdevices = 0
-    devices_list = list()
-    state = ""
 
+def parse_ws_data(devices, coordinator, diff=None):
+    # returns the keys of the devices that changed, empty when nothing relevant moved
     if not devices["object"]["onlineList"]:
         _LOGGER.info(f"No onlineList in websocket update, skipping")
-        return
-
-    numberofdevices = len(devices["object"]["deviceList"])
-    # _LOGGER.info("number of devices is: %s", numberofdevices)
-
-    for i in range(numberofdevices):
-        dev_id = devices["object"]["deviceList"][i]["id"]
-        # _LOGGER.info("dev_id is: %s", dev_id)
-        model_no = str(devices["object"]["deviceList"][i]["type"]).zfill(2) + str(
-            devices["object"]["deviceList"][i]["stype"]
-        ).zfill(2)
-        # _LOGGER.info("model_no is: %s", model_no)
-
-        if model_no == "0102":
-            continue  # skips the gateway for now, doesn't add it to devices_list
-
-        if model_no not in has_two_entities and model_no not in is_cover:
-            try:
-                if devices["object"]["onlineList"][str(dev_id)]["br"] > 0:
-                    state = True
-                elif devices["object"]["onlineList"][str(dev_id)]["br"] == 0:
-                    state = ""
-            except:
-                _LOGGER.info(
-                    "unable to get status for %s because it is not online",
-                    devices["object"]["deviceList"][i]["name"],
-                )
-                continue
+        return set()
 
-        # _LOGGER.info("new state is: %s", state)
-
-        if model_no in has_dimming:
-            br_cur = (
-                int(devices["object"]["onlineList"][str(dev_id)]["br"]) / 100
-            ) * 255
-        else:
-            br_cur = ""
-
-        if model_no in has_two_entities:
-            # left first
-            device_name = devices["object"]["deviceList"][i]["left_name"]
-            master_device_name = devices["object"]["deviceList"][i]["name"]
-            side = "left"
-            try:
-                if (devices["object"]["onlineList"][str(dev_id)]["r"] == 1) or (
-                    devices["object"]["onlineList"][str(dev_id)]["r"] == 3
-                ):
-                    state = True
-                else:
-                    state = ""
-            except:
-                _LOGGER.info(
-                    "unable to get status for %s because it is not online",
-                    devices["object"]["deviceList"][i]["name"],
-                )
-                continue
-        else:
-            device_name = devices["object"]["deviceList"][i]["name"]
-            master_device_name = ""
-            side = ""
-
-        if model_no in is_cover:
-            state = None
-
-        has_usb = ""
-
-        devices_list.append(
-            {
-                "name": device_name,
-                "id": devices["object"]["deviceList"][i]["id"],
-                "br_cur": br_cur,
-                "mac": devices["object"]["deviceList"][i]["mac"],
-                "state": state,
-                "type": devices["object"]["deviceList"][i]["type"],
-                "stype": devices["object"]["deviceList"][i]["stype"],
-                "email": config["email"],
-                "applicationid": config["applicationid"],
-                "installationid": config["installationid"],
-                "clientkey": config["clientkey"],
-                "userid": session_data["userid"],
-                "homeid": session_data["homeid"],
-                "livegroup_objectid": session_data["livegroup_objectid"],
-                "sessiontoken": session_data["sessiontoken"],
-                "master_device_name": master_device_name,
-                "side": side,
-                "has_usb": has_usb,
-                "has_usb_update": "",
-            }
-        )
-        # _LOGGER.info("the interim devices list is: %s", devices_list)
-        if model_no in dev_has_usb:
-            has_usb = True
-
-            for device in (
-                coordinator.data
-            ):  # usb state is not provided in the update so looking for existing state
-                if (dev_id == device["id"]) and (device["has_usb"]):
-                    state = device["state"]
-                    # _LOGGER.info("state from coordinator data is: %s", state)
-
-            devices_list.append(
-                {
-                    "name": device_name,
-                    "id": devices["object"]["deviceList"][i]["id"],
-                    "br_cur": br_cur,
-                    "mac": devices["object"]["deviceList"][i]["mac"],
-                    "state": state,
-                    "type": devices["object"]["deviceList"][i]["type"],
-                    "stype": devices["object"]["deviceList"][i]["stype"],
-                    "email": config["email"],
-                    "applicationid": config["applicationid"],
-                    "installationid": config["installationid"],
-                    "clientkey": config["clientkey"],
-                    "userid": session_data["userid"],
-                    "homeid": session_data["homeid"],
-                    "livegroup_objectid": session_data["livegroup_objectid"],
-                    "sessiontoken": session_data["sessiontoken"],
-                    "side": side,
-                    "has_usb": has_usb,
-                    "has_usb_update": True,
-                }
-            )
-
-        elif model_no in has_two_entities:
-            device_name = devices["object"]["deviceList"][i]["right_name"]
-            side = "right"
-            if (devices["object"]["onlineList"][str(dev_id)]["r"] == 2) or (
-                devices["object"]["onlineList"][str(dev_id)]["r"] == 3
-            ):
-                state = True
-            else:
-                state = ""
-
-            devices_list.append(
-                {
-                    "name": device_name,
-                    "id": devices["object"]["deviceList"][i]["id"],
-                    "br_cur": br_cur,
-                    "mac": devices["object"]["deviceList"][i]["mac"],
-                    "state": state,
-                    "type": devices["object"]["deviceList"][i]["type"],
-                    "stype": devices["object"]["deviceList"][i]["stype"],
-                    "email": config["email"],
-                    "applicationid": config["applicationid"],
-                    "installationid": config["installationid"],
-                    "clientkey": config["clientkey"],
-                    "userid": session_data["userid"],
-                    "homeid": session_data["homeid"],
-                    "livegroup_objectid": session_data["livegroup_objectid"],
-                    "sessiontoken": session_data["sessiontoken"],
-                    "side": side,
-                    "has_usb": has_usb,
-                    "has_usb_update": "",
-                }
-            )
-
-    # _LOGGER.info("the updated devices list is: %s", devices_list)
-    # print(devices_list)
-    return devices_list
+    if diff is not None:
+        return apply_home_diff(coordinator.data, devices["object"], diff)
+    return update_store(coordinator.data, devices["object"], from_ws=True)
 
 
 def parse_single_ws_update(coordinator, ws_update):
+    # decodes the bleData frames of a LiveGroup update, short status frames and
+    # echoed command frames for one or several devices
+    # returns the keys of the devices that changed
     devices_list = coordinator.data
-    # _LOGGER.info("devices list from coordinator: %s", devices_list)
 
     update_data = ws_update["object"]["Result"]["data"]["data"]
     if type(update_data) is dict:
         update_data = update_data["data"]
 
-    if len(update_data) > 30:
+    try:
+        records = codec.decode_records(update_data)
+    except ValueError:
         _LOGGER.debug(update_data)
-        raise ValueError("update with long string - skipping")
-
-    mac_id = update_data[20:22]
-    new_state_data = update_data[24:26]
-    # _LOGGER.info("mac_id: %s, new_state_data: %s", mac_id, new_state_data)
-
-    for device in devices_list:
-        # _LOGGER.info(device["mac"][15:])
-        if (mac_id == hex(device["id"])[2:].zfill(2)) and (device["has_usb"]):
-            # _LOGGER.info(device["has_usb"])
-
-            if (new_state_data == "0f") or (new_state_data == "0e"):
-                device["state"] = True
-                # _LOGGER.info("new device state is: %s", device["state"])
-            elif (new_state_data == "0d") or (new_state_data == "0c"):
-                device["state"] = ""
-                # _LOGGER.info("new device state is: %s", device["state"])
-            device["has_usb_update"] = True
-            # _LOGGER.info("has usb update is: %s", device["has_usb_update"])
-    # _LOGGER.info("devices list after small update is: %s", devices_list)
-    return devices_list
-
-
-def initiate_cover(data):
-    light_command_number = "00"
-    mac_id = hex(data._id)[2:].zfill(2)
+        raise
+
+    changed = set()
+    for record in records:
+        # the mac id in the frame is the device id
+        key = device_key(record.mac_id, record.side, record.usb)
+        device = devices_list.get(key)
+        if device is None:
+            continue
+
+        fields = {"state": True if record.on else ""}
+        if record.usb:
+            fields["has_usb_update"] = True
+        if record.brightness is not None and device.caps.flags & Capability.DIMMING:
+            fields["br_cur"] = record.brightness
+
+        if devices_list.apply_partial(key, fields):
+            changed.add(key)
+
+    # the bridge echoing a frame we sent confirms the command
+    coordinator.pending.async_frames_echoed(update_data)
+
+    return changed
+
+
+async def initiate_cover(data):
     cover_command_list = []
     cover_response = []
 
@@ -919,56 +912,20 @@ def initiate_cover(data):
 
     cover_command_list.sort()
 
-    api_url_web_livegroup_instance = (
-        "https://www.pixie.app/p0/pixieCloud/classes/LiveGroup/"
-        + data._livegroup_objectid
-    )
-
+    # the programming frames have to reach the device in order, so they are sent one after the other
     for x in cover_command_list:
-        if x == 10:
-            light_command_data = (
-                str(light_command_number)
-                + "00000304"
-                + str(mac_id)
-                + "00fa6b69000101027700"
-            )
-        else:
-            light_command_data = (
-                str(light_command_number)
-                + "00000304"
-                + str(mac_id)
-                + "00fa6b690"
-                + str(x)
-                + "0101017700"
-            )
-
-        bleData_request_data = {
-            "data": light_command_data,
-            "type": "bleData",
-            "repeat": 2,
-        }
-        bleData_request = {
-            "data": bleData_request_data,
-            "from": data._email,
-            "time": unix_time(),
-            "to": "ALL",
-        }
-        bleData = {"Cmd": 2, "Request": bleData_request}
-        # bleData.update(ID_param)
+        light_command_data = codec.encode_cover_program(data._id, x)
 
-        headers = {
-            "x-parse-session-token": data._sessiontoken,
-            "x-parse-application-id": data._applicationid,
-            "x-parse-client-key": data._clientkey,
-        }
-        _LOGGER.debug(f"cover request_headers: {headers}")
-        _LOGGER.debug(f"cover request_data: {bleData}")
+        _LOGGER.debug(f"cover request_data: {light_command_data}")
 
-        request = httpx.put(
-            api_url_web_livegroup_instance, json=bleData, headers=headers
+        result = await send_ble_command(
+            data.coordinator,
+            data._id,
+            light_command_data,
+            data.coordinator.session.email,
+            repeat=2,
+            lane=LANE_BACKGROUND,
         )
-        result = request.json()
-        #        request = httpx.post(api_url_web_livegroup_instance, json=bleData)
 
         cover_response.append(result)
 
@@ -0,0 +1,166 @@
+"""Rate limited, prioritised access to the Pixie cloud for outbound commands."""
+
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import logging
+
+from homeassistant.core import Context, HomeAssistant, callback
+
+from .const import COMMAND_BURST, COMMAND_CONCURRENCY, COMMAND_RATE
+from .latency import LatencyHistogram
+
+_LOGGER = logging.getLogger(__name__)
+
+# lanes in priority order, a lane is only served when the ones before it are empty
+LANE_INTERACTIVE = "interactive"
+LANE_AUTOMATION = "automation"
+LANE_BACKGROUND = "background"
+LANES = (LANE_INTERACTIVE, LANE_AUTOMATION, LANE_BACKGROUND)
+
+
+def command_lane(context: Context | None):
+    """Return the lane of a command, interactive when a user asked for it."""
+    if context is not None and context.user_id is not None:
+        return LANE_INTERACTIVE
+    return LANE_AUTOMATION
+
+
+class CommandScheduler:
+    """Token bucket in front of the command transport, with priority lanes.
+
+    Every PUT to the cloud takes a token, tokens come back at rate per second
+    up to burst, and at most concurrency PUTs are in flight. Within a lane the
+    devices take turns, so a bulk automation on one group of devices does not
+    hold back the others, and a device has at most one PUT in flight.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        rate=COMMAND_RATE,
+        burst=COMMAND_BURST,
+        concurrency=COMMAND_CONCURRENCY,
+    ) -> None:
+        """Initialize the scheduler."""
+        self.hass = hass
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self._tokens = float(burst)
+        self._refilled = hass.loop.time()
+        # lane -> device -> futures of the waiting commands, devices in turn order
+        self._lanes: dict[str, OrderedDict[tuple, deque[asyncio.Future]]] = {
+            lane: OrderedDict() for lane in LANES
+        }
+        self._busy: set[tuple] = set()
+        self._wakeup = None
+        self.waits = {lane: LatencyHistogram() for lane in LANES}
+
+    @asynccontextmanager
+    async def async_slot(self, lane, device):
+        """Wait for a token and a free slot for device, hold the slot while in the block.
+
+        Yields the seconds the command waited in the queue.
+        """
+        loop = self.hass.loop
+        started = loop.time()
+        future = loop.create_future()
+        self._lanes[lane].setdefault(device, deque()).append(future)
+        self._async_dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                # granted just before the caller went away
+                self._async_release(device)
+            else:
+                self._async_forget(lane, device, future)
+            raise
+
+        waited = loop.time() - started
+        self.waits[lane].add(waited)
+        try:
+            yield waited
+        finally:
+            self._async_release(device)
+
+    @callback
+    def _async_release(self, device):
+        self._busy.discard(device)
+        self._async_dispatch()
+
+    @callback
+    def _async_forget(self, lane, device, future):
+        waiters = self._lanes[lane].get(device)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(future)
+        except ValueError:
+            return
+        if not waiters:
+            del self._lanes[lane][device]
+
+    def _refill(self):
+        now = self.hass.loop.time()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _next_waiter(self):
+        # the first device of the highest lane that has nothing in flight
+        for queue in self._lanes.values():
+            for device, waiters in queue.items():
+                if device in self._busy:
+                    continue
+                # the device goes to the back of the lane for its next command
+                del queue[device]
+                future = waiters.popleft()
+                if waiters:
+                    queue[device] = waiters
+                return device, future
+        return None
+
+    @callback
+    def _async_dispatch(self):
+        while len(self._busy) < self.concurrency:
+            self._refill()
+            if self._tokens < 1:
+                if self._wakeup is None and any(self._lanes.values()):
+                    self._wakeup = self.hass.loop.call_later(
+                        (1 - self._tokens) / self.rate, self._async_wakeup
+                    )
+                return
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            device, future = waiter
+            self._tokens -= 1
+            self._busy.add(device)
+            future.set_result(None)
+
+    @callback
+    def _async_wakeup(self):
+        self._wakeup = None
+        self._async_dispatch()
+
+    @property
+    def depth(self):
+        """Return the number of commands waiting for a slot."""
+        return sum(
+            len(waiters) for queue in self._lanes.values() for waiters in queue.values()
+        )
+
+    def as_dict(self):
+        """Return the limits, the queue depth and the wait times per lane in ms."""
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "concurrency": self.concurrency,
+            "in_flight": len(self._busy),
+            "waiting": self.depth,
+            "wait": {lane: histogram.as_dict() for lane, histogram in self.waits.items()},
+        }
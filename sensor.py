@@ -0,0 +1,78 @@
+"""Diagnostic sensors for Pixie Plus command latency."""
+
+from __future__ import annotations
+
+from datetime import timedelta
+
+from homeassistant import config_entries
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorStateClass,
+)
+from homeassistant.const import EntityCategory, UnitOfTime
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .const import DOMAIN
+from .latency import (
+    PHASE_CONFIRMED,
+    PHASE_ECHO,
+    PHASE_ENCODE,
+    PHASE_PUT,
+    PHASE_QUEUE,
+    PHASES,
+)
+
+# the statistics are read, not pushed, so a busy home does not write a state per command
+SCAN_INTERVAL = timedelta(seconds=60)
+
+PHASE_NAMES = {
+    PHASE_ENCODE: "Command encode latency",
+    PHASE_QUEUE: "Command queue latency",
+    PHASE_PUT: "Command cloud latency",
+    PHASE_ECHO: "Command echo latency",
+    PHASE_CONFIRMED: "Command confirmation latency",
+}
+
+
+async def async_setup_entry(
+    hass: HomeAssistant,
+    config_entry: config_entries.ConfigEntry,
+    async_add_entities: AddEntitiesCallback,
+) -> None:
+    """Set up the Pixie Plus latency sensors."""
+    coordinator = hass.data[DOMAIN][config_entry.entry_id]
+
+    async_add_entities(PixiePlusLatencySensor(coordinator, phase) for phase in PHASES)
+
+
+class PixiePlusLatencySensor(SensorEntity):
+    """p95 latency of one command phase, with the per device type breakdown."""
+
+    _attr_device_class = SensorDeviceClass.DURATION
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_native_unit_of_measurement = UnitOfTime.MILLISECONDS
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_has_entity_name = True
+    _attr_should_poll = True
+
+    def __init__(self, coordinator, phase) -> None:
+        """Initialize the sensor."""
+        self._latency = coordinator.latency
+        self._phase = phase
+        self._attr_name = PHASE_NAMES[phase]
+        self._attr_unique_id = f"{coordinator.entry_id}_latency_{phase}"
+        self._attr_device_info = {
+            "identifiers": {(DOMAIN, "Pixie Plus Hub")},
+            "name": "Pixie Plus Hub",
+            "manufacturer": "SAL - Pixie Plus",
+        }
+
+    async def async_update(self) -> None:
+        """Read the latest statistics."""
+        stats = self._latency.as_dict()[self._phase]
+        overall = stats.get("all", {})
+        self._attr_native_value = overall.get("p95")
+        # per device type p50/p95/p99, keyed by model number
+        self._attr_extra_state_attributes = stats
@@ -0,0 +1,92 @@
+"""Session state shared by all devices of a Pixie Plus config entry."""
+
+from __future__ import annotations
+
+import time
+
+from .const import CONF_HOME_ID
+
+# Parse error code for an invalid or expired session token
+INVALID_SESSION_TOKEN = 209
+
+
+class InvalidSessionError(Exception):
+    """Error to indicate the cloud rejected the session token."""
+
+    def __init__(self, session, message=None) -> None:
+        """Initialize the error with the session whose token was rejected."""
+        super().__init__(message)
+        self.session = session
+
+
+def is_invalid_session(response):
+    """Return True if a REST or LiveQuery response rejects the session token."""
+    if not isinstance(response, dict):
+        return False
+    if response.get("code") == INVALID_SESSION_TOKEN:
+        return True
+    # LiveQuery reports the same problem as an error op
+    return response.get("op") == "error" and "session token" in str(
+        response.get("error", "")
+    ).lower()
+
+
+class PixieSession:
+    """Credentials and cloud session of one Pixie Plus account and home.
+
+    Every device record and entity refers to the same session, so a new
+    session token is a single assignment. Whoever holds state tied to the
+    token (the websocket subscriptions) registers in token_listeners to be
+    told when it changes.
+    """
+
+    __slots__ = (
+        "email",
+        "applicationid",
+        "installationid",
+        "clientkey",
+        "userid",
+        "homeid",
+        "sessiontoken",
+        "token_issued",
+        "livegroup_objectid",
+        "bridge_name",
+        "login_data",
+        "renewing",
+        "token_listeners",
+    )
+
+    def __init__(self, config, session_data) -> None:
+        """Initialize the session from the config entry and login data."""
+        self.email = config["email"]
+        self.applicationid = config["applicationid"]
+        self.installationid = config["installationid"]
+        self.clientkey = config["clientkey"]
+        self.userid = session_data["userid"]
+        self.homeid = session_data["homeid"]
+        self.sessiontoken = session_data["sessiontoken"]
+        # time.time() of the login that handed out the token, a fresh login unless restored
+        self.token_issued = session_data.get("token_issued", time.time())
+        self.livegroup_objectid = session_data.get("livegroup_objectid")
+        self.bridge_name = session_data.get("bridge_name")
+        self.login_data = {
+            "applicationid": config["applicationid"],
+            "installationid": config["installationid"],
+            "clientkey": config["clientkey"],
+            "email": config["email"],
+            "password": config["password"],
+            # the home chosen in the config flow, None for entries from before
+            CONF_HOME_ID: config.get(CONF_HOME_ID),
+        }
+        # the login in flight while the token is being renewed
+        self.renewing = None
+        self.token_listeners = []
+
+    @property
+    def headers(self):
+        """Return the headers for authenticated REST requests."""
+        return {
+            "x-parse-session-token": self.sessiontoken,
+            "x-parse-application-id": self.applicationid,
+            "x-parse-client-key": self.clientkey,
+        }
@@ -0,0 +1,95 @@
+"""Persisted device snapshot and session of a Pixie Plus config entry."""
+
+from __future__ import annotations
+
+import logging
+import time
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+
+from .const import CONF_HOME_ID, DOMAIN, SESSION_CACHE_MAX_AGE, SNAPSHOT_SAVE_DELAY
+from .device_store import DeviceStore
+from .pixiepluslogin import update_store
+from .session import PixieSession
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+
+# only these parts of the Home object are needed to rebuild the device store
+HOME_KEYS = ("objectId", "updatedAt", "deviceList", "onlineList")
+
+
+class PixieSnapshot:
+    """Last known devices, LiveGroup and session token of one config entry.
+
+    Lets the entities be created right away on startup while the cloud is
+    asked for the current state in the background.
+    """
+
+    def __init__(self, hass: HomeAssistant, entry_id) -> None:
+        """Initialize the snapshot."""
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}")
+        self._devices_list = None
+
+    async def async_restore(self, config):
+        """Return (devices_list, session) from storage, None if there is nothing usable."""
+        data = await self._store.async_load()
+        if not data or data.get("email") != config["email"]:
+            return None
+        home_id = config.get(CONF_HOME_ID)
+        if home_id is not None and data["session"].get("homeid") != home_id:
+            # the snapshot is of another home, its LiveGroup and devices don't apply
+            _LOGGER.debug("Ignoring the device snapshot of home %s", data["session"].get("homeid"))
+            return None
+
+        session_data = dict(data["session"])
+        # snapshots from before token_issued was kept count as too old
+        session_data.setdefault("token_issued", 0)
+        if time.time() - session_data["token_issued"] > SESSION_CACHE_MAX_AGE:
+            # the first request logs in again instead of trying a likely dead token
+            session_data["sessiontoken"] = None
+
+        try:
+            session = PixieSession(config, session_data)
+            devices_list = DeviceStore(session)
+            update_store(devices_list, data["home"])
+        except (KeyError, TypeError, ValueError) as err:
+            _LOGGER.warning("Ignoring unreadable device snapshot: %s", err)
+            return None
+
+        if not devices_list:
+            return None
+        return (devices_list, session)
+
+    @callback
+    def async_schedule_save(self, devices_list):
+        """Write the snapshot of devices_list after a short delay."""
+        if devices_list is None or devices_list.home is None:
+            return
+        self._devices_list = devices_list
+        self._store.async_delay_save(self._data_to_save, SNAPSHOT_SAVE_DELAY)
+
+    async def async_remove(self):
+        """Remove the snapshot from storage."""
+        await self._store.async_remove()
+
+    @callback
+    def _data_to_save(self):
+        devices_list = self._devices_list
+        session = devices_list.session
+        home = devices_list.home
+        return {
+            "email": session.email,
+            "saved_at": time.time(),
+            "session": {
+                "userid": session.userid,
+                "homeid": session.homeid,
+                "sessiontoken": session.sessiontoken,
+                "token_issued": session.token_issued,
+                "livegroup_objectid": session.livegroup_objectid,
+                "bridge_name": session.bridge_name,
+            },
+            "home": {key: home[key] for key in HOME_KEYS if key in home},
+        }
@@ -31,7 +31,9 @@ from homeassistant.helpers.dispatcher import async_dispatcher_connect
 
 from typing import Any
 
-from .const import DOMAIN, hardware_list, is_switch, has_two_entities
+from .capabilities import Capability
+from .const import DOMAIN
+from .entity import PixiePlusEntity
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -54,47 +56,38 @@ async def async_setup_entry(
     # adding entities
 
     async_add_entities(
-        PixiePlusSwitch(coordinator, idx)
-        for idx, ent in enumerate(coordinator.data)
-        if (str(ent["type"]).zfill(2) + str(ent["stype"]).zfill(2)) in is_switch
+        PixiePlusSwitch(coordinator, key)
+        for key, ent in coordinator.data.items()
+        if ent.caps.platform == "switch"
     )
 
 
-class PixiePlusSwitch(CoordinatorEntity, SwitchEntity, RestoreEntity):
+class PixiePlusSwitch(PixiePlusEntity, SwitchEntity, RestoreEntity):
     """Representation of a Pixie Plus Light."""
 
-    def __init__(self, coordinator, idx):
+    def __init__(self, coordinator, key):
         """Initialize a Pixie Plus Light."""
 
-        super().__init__(coordinator)
-        self.idx = idx
-        self._mac = self.coordinator.data[self.idx]["mac"]
-        self._id = self.coordinator.data[self.idx]["id"]
-        self._type = self.coordinator.data[self.idx]["type"]
-        self._stype = self.coordinator.data[self.idx]["stype"]
-        self._applicationid = self.coordinator.data[self.idx]["applicationid"]
-        self._installationid = self.coordinator.data[self.idx]["installationid"]
-        self._clientkey = self.coordinator.data[self.idx]["clientkey"]
-        self._userid = self.coordinator.data[self.idx]["userid"]
-        self._homeid = self.coordinator.data[self.idx]["homeid"]
-        self._livegroup_objectid = self.coordinator.data[self.idx]["livegroup_objectid"]
-        self._sessiontoken = self.coordinator.data[self.idx]["sessiontoken"]
-        self._has_usb = self.coordinator.data[self.idx]["has_usb"]
+        super().__init__(coordinator, key)
+        self._mac = self._device.mac
+        self._id = self._device.id
+        self._type = self._device.type
+        self._stype = self._device.stype
+        self._has_usb = self._device.has_usb
         self._attr_has_entity_name = True
-        self._state = self.coordinator.data[self.idx]["state"]
-        self._attr_is_on = self.coordinator.data[self.idx]["state"]
-        self._has_usb_update = self.coordinator.data[self.idx]["has_usb_update"]
-        self._model_no = str(self._type).zfill(2) + str(self._stype).zfill(2)
-        self._side = self.coordinator.data[self.idx]["side"]
+        self._state = self._device.state
+        self._attr_is_on = self._device.state
+        self._has_usb_update = self._device.has_usb_update
+        self._model_no = self._caps.model_no
+        self._has_two_entities = bool(self._caps.flags & Capability.TWO_ENTITIES)
+        self._side = self._device.side
         if self._has_usb:
             self._attr_unique_id = self._mac + "_USB"
             self._attr_name = "USB"
-        elif self._model_no in has_two_entities:
-            self._master_device_name = self.coordinator.data[self.idx][
-                "master_device_name"
-            ]
+        elif self._has_two_entities:
+            self._master_device_name = self._device.master_device_name
             self._attr_unique_id = self._mac + self._side
-            self._attr_name = self.coordinator.data[self.idx]["name"]
+            self._attr_name = self._device.name
         else:
             self._attr_unique_id = self._mac
             self._attr_name = None
@@ -106,23 +99,22 @@ class PixiePlusSwitch(CoordinatorEntity, SwitchEntity, RestoreEntity):
         state = await self.async_get_last_state()
 
         if self._has_usb:
-            if state.state == "on":
-                new_state = True
-                self.coordinator.data[self.idx]["state"] = new_state
-                self.coordinator.async_set_updated_data(self.coordinator.data)
-            elif state.state == "off":
-                new_state = ""
-                self.coordinator.data[self.idx]["state"] = new_state
-                self.coordinator.async_set_updated_data(self.coordinator.data)
+            # the cloud never reports the USB port, the last known state is the best guess
+            if state is None:
+                _LOGGER.info(f"No last USB state")
+            elif state.state in ("on", "off"):
+                new_state = True if state.state == "on" else ""
+                if self.coordinator.data.apply_partial(self._key, {"state": new_state}):
+                    self.coordinator.async_update_devices({self._key})
             else:
                 _LOGGER.info(f"Unknown last USB state")
 
     @property
     def device_info(self):
-        if self._model_no in has_two_entities:
+        if self._has_two_entities:
             name = self._master_device_name
         else:
-            name = self.coordinator.data[self.idx]["name"]
+            name = self._device.name
 
         return {
             "identifiers": {
@@ -131,7 +123,7 @@ class PixiePlusSwitch(CoordinatorEntity, SwitchEntity, RestoreEntity):
             },
             "name": name,
             "manufacturer": "SAL - Pixie Plus",
-            "model": hardware_list[self._model_no],
+            "model": self._caps.hardware_name,
             "via_device": (DOMAIN, "Pixie Plus Hub"),
         }
 
@@ -143,14 +135,14 @@ class PixiePlusSwitch(CoordinatorEntity, SwitchEntity, RestoreEntity):
     def _handle_coordinator_update(self) -> None:
         """Handle updated data from the coordinator."""
 
-        # name = self.coordinator.data[self.idx]["name"]
-        # new_state = self.coordinator.data[self.idx]["state"]
+        # name = self._device.name
+        # new_state = self._device.state
         # _LOGGER.info(
         #    f"device {name} with has_usb of: {self._has_usb}, new state is {new_state}"
         # )
 
-        self._attr_is_on = self.coordinator.data[self.idx]["state"]
-        self._state = self.coordinator.data[self.idx]["state"]
+        self._attr_is_on = self._device.state
+        self._state = self._device.state
         self.async_write_ha_state()
 
     '''
@@ -170,13 +162,8 @@ class PixiePlusSwitch(CoordinatorEntity, SwitchEntity, RestoreEntity):
 
         other = ()
 
-        await pixiepluslogin.change_light(self, "on", other)
-
-        # assumes success - will get a push update after few second and will adjust according to the real state
-
-        # _LOGGER.info(f"first updat, assuming success")
-        self.coordinator.data[self.idx]["state"] = True
-        self.coordinator.async_set_updated_data(self.coordinator.data)
+        # assumes success until the bridge confirms it, rolled back if it never does
+        await pixiepluslogin.change_light(self, "on", other, {"state": True})
 
         # await self.coordinator.async_request_refresh()
 
@@ -185,9 +172,6 @@ class PixiePlusSwitch(CoordinatorEntity, SwitchEntity, RestoreEntity):
 
         other = ()
 
-        await pixiepluslogin.change_light(self, "00", other)
-
-        self.coordinator.data[self.idx]["state"] = ""
-        self.coordinator.async_set_updated_data(self.coordinator.data)
+        await pixiepluslogin.change_light(self, "00", other, {"state": ""})
 
         # await self.coordinator.async_request_refresh()
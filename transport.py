@@ -0,0 +1,63 @@
+"""Async command transport for the Pixie Plus cloud."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+
+import httpx
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.httpx_client import get_async_client
+
+from .const import COMMAND_CONNECT_TIMEOUT, COMMAND_TIMEOUT
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PixieTransport:
+    """Send commands to the LiveGroup over Home Assistant's shared httpx client.
+
+    The client is long lived and keeps its connections to pixie.app alive, so
+    a command normally reuses an open TLS connection. One transport is shared
+    by all config entries. Commands to the same device of a LiveGroup are sent
+    one at a time to keep them in order, other commands run concurrently.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        """Initialize the transport."""
+        self._client = get_async_client(hass, False)
+        self._timeout = httpx.Timeout(COMMAND_TIMEOUT, connect=COMMAND_CONNECT_TIMEOUT)
+        # device ids are only unique within a home, so the LiveGroup url is part of the key
+        self._device_locks: dict[tuple[str, int], asyncio.Lock] = {}
+
+    def _lock_for(self, url, device_id) -> asyncio.Lock:
+        lock = self._device_locks.get((url, device_id))
+        if lock is None:
+            lock = self._device_locks[(url, device_id)] = asyncio.Lock()
+        return lock
+
+    async def async_put(self, url, payload, headers, device_id=None):
+        """PUT a json payload and return the decoded response, None on failure."""
+
+        async with self._lock_for(url, device_id):
+            try:
+                response = await self._client.put(
+                    url, json=payload, headers=headers, timeout=self._timeout
+                )
+            except httpx.TimeoutException:
+                _LOGGER.warning("timed out sending command to %s", url)
+                return None
+            except httpx.HTTPError as err:
+                _LOGGER.warning("error sending command to %s: %s", url, err)
+                return None
+
+        _LOGGER.debug(payload)
+        _LOGGER.debug(response.url)
+        _LOGGER.debug(response.text)
+
+        try:
+            return response.json()
+        except ValueError:
+            _LOGGER.debug("command response unable to be processed by json")
+            return None
@@ -0,0 +1,103 @@
+"""Bounded queue between the LiveQuery socket reader and the update parser."""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+import re
+
+from .const import WS_QUEUE_SIZE
+
+# found without decoding the message, a Home snapshot is only worth parsing if it is the newest
+_REQUEST_ID = re.compile(r'"requestId"\s*:\s*(\d+)')
+_HOME_MARKER = '"deviceList"'
+
+
+class UpdateQueue:
+    """Raw websocket messages waiting to be decoded and applied.
+
+    Putting never blocks, so the socket keeps draining however slow the
+    parsing is. A Home snapshot replaces the queued snapshot of the same
+    subscription, and the newer one goes to the back so it is applied after
+    the LiveGroup frames that came before it. Everything else keeps its
+    order. When the queue is full the oldest message is dropped.
+    """
+
+    def __init__(self, maxsize=WS_QUEUE_SIZE) -> None:
+        """Initialize the queue."""
+        self.maxsize = maxsize
+        # [text, requestId of a Home snapshot or None], text is None once superseded
+        self._items = deque()
+        self._snapshots = {}
+        self._ready = asyncio.Event()
+        self.depth = 0
+        self.max_depth = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def put(self, text):
+        """Queue a message, return False if an unprocessed message had to be dropped."""
+        request_id = None
+        if _HOME_MARKER in text:
+            match = _REQUEST_ID.search(text)
+            request_id = int(match.group(1)) if match else -1
+            previous = self._snapshots.get(request_id)
+            if previous is not None:
+                previous[0] = None
+                self.depth -= 1
+                self.coalesced += 1
+
+        item = [text, request_id]
+        if request_id is not None:
+            self._snapshots[request_id] = item
+        self._items.append(item)
+        self.depth += 1
+        self._ready.set()
+
+        kept = True
+        # superseded snapshots don't count, only messages still waiting do
+        while self.depth > self.maxsize:
+            oldest = self._items.popleft()
+            if oldest[0] is None:
+                continue
+            self._forget(oldest)
+            self.depth -= 1
+            self.dropped += 1
+            kept = False
+        if len(self._items) > 2 * self.maxsize:
+            # a snapshot burst leaves tombstones behind the live messages
+            self._items = deque(item for item in self._items if item[0] is not None)
+        self.max_depth = max(self.max_depth, self.depth)
+        return kept
+
+    def clear(self):
+        """Drop every waiting message, they came from a socket that is gone."""
+        self._items.clear()
+        self._snapshots.clear()
+        self.depth = 0
+
+    async def get(self):
+        """Return the next message, waiting for one if the queue is empty."""
+        while True:
+            while self._items:
+                item = self._items.popleft()
+                if item[0] is None:
+                    continue
+                self._forget(item)
+                self.depth -= 1
+                return item[0]
+            self._ready.clear()
+            await self._ready.wait()
+
+    def _forget(self, item):
+        if item[1] is not None and self._snapshots.get(item[1]) is item:
+            del self._snapshots[item[1]]
+
+    def as_dict(self):
+        """Return the queue statistics."""
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+        }